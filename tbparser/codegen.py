@@ -0,0 +1,607 @@
+# coding=UTF-8
+
+# This file is part of TBParser.
+#
+# TBParser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TBParser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TBParser.  If not, see <http://www.gnu.org/licenses/>.
+
+# Erzeugt aus einer Grammatik ein Python-Modul mit einer Parserfunktion je
+# Regel. Jede Funktion ist ein Generator, der die Ableitungen der Regel ab
+# einer Tokenposition in derselben Reihenfolge liefert, in der Parser den
+# Grammatikgraphen durchsucht (gleiche Ergebnisse beim Backtracking, gleiche
+# ASTs). Innerhalb einer Regel arbeitet ein Automat mit eigenem Stack, so
+# dass Wiederholungen die Rekursionstiefe nicht erhöhen. Tokenprüfungen sind
+# Bittests auf der Typmaske des Tokens.
+#
+# Einschränkungen: Die Expansion einer Regel darf den Kontext nicht lesen,
+# Conditions werden nicht unterstützt (Umgebungsvariablen spielen daher keine
+# Rolle). transform-Funktionen müssen auf Modulebene definiert sein; bei
+# Regelklassen wird transform an einer Instanz ohne Konstruktoraufruf
+# gerufen.
+#
+# Das Modul enthält nur den Parser. Lexer und Tokentypen kommen zur Laufzeit
+# weiter aus der Grammatik, schneller wird also das Parsen, nicht der Start.
+# Die Garbage Collection bleibt Sache des Aufrufers (bei großen Eingaben
+# lohnt es, sie während des Parsens abzuschalten).
+#
+# Verwendung:
+#
+#   ParserGenerator(MyGrammar()).writeModule('my_parser.py')
+#   ...
+#   import my_parser
+#   parser = my_parser.Parser(MyGrammar())
+#   ast = parser.parseString(text)
+
+import sys
+
+from tbparser.grammar import Rule, _ConditionalNode, _CustomRule, _SwitchNode
+from tbparser.token import Keyword
+
+class CodeGenerationError(Exception):
+
+    pass
+
+class ParserGenerator(object):
+
+    def __init__(self, grammar):
+
+        self._grammar = grammar
+        self._typeTable = grammar.getTokenTypeTable()
+
+    def generate(self):
+
+        self._rules = [] # <- _RuleCode je Regel
+        self._ruleIndexes = {} # <- (Klasse, expand, Name, ID) -> Index
+        self._transforms = [] # <- (Modul, Name, ist Klasse)
+        self._transformIndexes = {}
+
+        socket = self._grammar.getSocket()
+        self._addRule(socket)
+
+        # Aufgerufene Regeln erst hier auflösen (Regeln, die schon bekannt
+        # sind, werden nur noch verglichen):
+        idx = 0
+        while idx < len(self._rules):
+            for state in self._rules[idx].states:
+                if state.kind == _State.CALL:
+                    state.ruleIndex = self._addRule(state.node)
+            idx += 1
+
+        self._mergeRules()
+
+        lines = [_HEADER % {'grammar': self._grammar.getName()}]
+        lines.extend(self._createImports())
+        lines.append(_HELPERS % {
+            'typeCount': self._typeTable.getSize(),
+            'keywordMask': self._getKeywordMask(),
+            'transforms': self._createTransformList(),
+            'rootName': socket.getName(),
+            'rootId': socket.getId()
+            })
+        for idx, rule in enumerate(self._rules):
+            lines.append(self._createRuleCode(idx, rule))
+
+        return '\n'.join(lines)
+
+    def writeModule(self, filePath):
+
+        code = self.generate()
+
+        with open(filePath, 'w') as moduleFile:
+            moduleFile.write(code)
+
+    def _addRule(self, startNode):
+
+        # Regeln gleicher Klasse, gleichen Namens und gleicher ID gelten als
+        # gleich (sonst endet die Expansion rekursiver Regeln nicht):
+        rule = startNode.getRule()
+        expandFunc = isinstance(rule, _CustomRule) and rule.getExpandFunc()
+        key = (type(rule), expandFunc, startNode.getName(), startNode.getId())
+
+        try:
+            successors = startNode.getSuccessors(_GeneratorContext())
+        except _ContextRead:
+            raise CodeGenerationError(
+                "Rule '%s' reads the context in expand" % startNode.getName())
+
+        code = _RuleCode(startNode.getName(), self._getTransformIndex(rule))
+        builder = _StateBuilder(self._typeTable, startNode.getEndNode())
+        code.entry = builder.getTargets(successors)
+        code.states = builder.getStates()
+
+        if key in self._ruleIndexes:
+            idx = self._ruleIndexes[key]
+            if self._rules[idx].getSignature() != code.getSignature():
+                raise CodeGenerationError(
+                    "Rule '%s' expands differently for equal IDs"
+                    % startNode.getName())
+            return idx
+
+        self._rules.append(code)
+        self._ruleIndexes[key] = len(self._rules) - 1
+
+        return len(self._rules) - 1
+
+    def _mergeRules(self):
+
+        # Gleich aufgebaute Regeln mit gleich aufgebauten aufgerufenen Regeln
+        # zusammenfassen (Verfeinerung von Partitionen, wie bei der
+        # Minimierung endlicher Automaten):
+        classes = self._getClasses(
+            [code.getSignature() for code in self._rules])
+        while True:
+            signatures = []
+            for idx, code in enumerate(self._rules):
+                calls = tuple([classes[state.ruleIndex]
+                               for state in code.states
+                               if state.kind == _State.CALL])
+                signatures.append((classes[idx], calls))
+            newClasses = self._getClasses(signatures)
+            if len(set(newClasses)) == len(set(classes)):
+                break
+            classes = newClasses
+
+        # Je Klasse bleibt die erste Regel (Einstieg behält Index 0):
+        newIndexes = {}
+        rules = []
+        for idx, code in enumerate(self._rules):
+            if classes[idx] not in newIndexes:
+                newIndexes[classes[idx]] = len(rules)
+                rules.append(code)
+
+        for code in rules:
+            for state in code.states:
+                if state.kind == _State.CALL:
+                    state.ruleIndex = newIndexes[classes[state.ruleIndex]]
+
+        self._rules = rules
+
+    def _getClasses(self, signatures):
+
+        classIndexes = {}
+        res = []
+        for signature in signatures:
+            res.append(classIndexes.setdefault(signature, len(classIndexes)))
+
+        return res
+
+    def _getTransformIndex(self, rule):
+
+        if isinstance(rule, _CustomRule):
+            func = rule.getTransformFunc()
+            if not func:
+                return -1
+            key = (func.__module__, func.__name__, False)
+            obj = func
+        elif type(rule).transform.im_func is Rule.transform.im_func:
+            return -1
+        else:
+            cls = type(rule)
+            key = (cls.__module__, cls.__name__, True)
+            obj = cls
+
+        module = sys.modules.get(key[0])
+        if getattr(module, key[1], None) is not obj:
+            raise CodeGenerationError(
+                "Transformation '%s' is not accessible at module level" % key[1])
+
+        if key not in self._transformIndexes:
+            self._transformIndexes[key] = len(self._transforms)
+            self._transforms.append(key)
+
+        return self._transformIndexes[key]
+
+    def _createImports(self):
+
+        res = []
+        for idx, (module, name, isClass) in enumerate(self._transforms):
+            res.append("from %s import %s as _T%d" % (module, name, idx))
+
+        return res
+
+    def _createTransformList(self):
+
+        items = []
+        for idx, (module, name, isClass) in enumerate(self._transforms):
+            if isClass:
+                items.append("_T%d.__new__(_T%d).transform" % (idx, idx))
+            else:
+                items.append("_T%d" % idx)
+
+        return '[' + ', '.join(items) + ']'
+
+    def _getKeywordMask(self):
+
+        res = 0
+        for idx in range(self._typeTable.getSize()):
+            if isinstance(self._typeTable.getType(idx), Keyword):
+                res |= 1 << idx
+
+        return res
+
+    def _createRuleCode(self, idx, rule):
+
+        lines = []
+        add = lines.append
+
+        add("def _rule%d(st, pos, trail):" % idx)
+        add("    # %s" % rule.name)
+        add("    masks = st.masks")
+        add("    n = st.n")
+        add("    stack = [%s]" % ', '.join(
+            ["(%d, pos, trail, None)" % target
+             for target in reversed(rule.entry)]))
+        add("    while stack:")
+        add("        state, pos, trail, gen = stack.pop()")
+        add("        if state < 0:")
+        add("            st.atEnd = pos >= n # <- s. _addGoto")
+        add("            continue")
+        add("        while True:")
+
+        numStates = len(rule.states)
+        keyword = 'if'
+        for state in rule.states:
+
+            add("            %s state == %d:" % (keyword, state.index))
+            keyword = 'elif'
+            ind = ' ' * 16
+
+            if state.kind == _State.TOKEN:
+                add(ind + "# %s" % state.description)
+                add(ind + "if pos < n and masks[pos] & %d:" % state.mask)
+                add(ind + "    trail = ((_TOKEN, %r, pos), trail)" % state.id)
+                add(ind + "    pos += 1")
+                add(ind + "    if pos > st.maxPos:")
+                add(ind + "        st.maxPos = pos")
+                self._addGoto(lines, ind + '    ', rule, state.targets)
+                add(ind + "else:")
+                add(ind + "    st.atEnd = pos >= n")
+                add(ind + "    break")
+
+            elif state.kind == _State.CALL:
+                resume = numStates + state.index
+                add(ind + "gen = _rule%d(st, pos, ((_START, %r, %r), trail))"
+                    % (state.ruleIndex, state.name, state.id))
+                add(ind + "state = %d" % resume)
+                add("            elif state == %d:" % resume)
+                add(ind + "res = next(gen, None)")
+                add(ind + "if res is None:")
+                add(ind + "    break")
+                add(ind + "stack.append((%d, pos, trail, gen))" % resume)
+                add(ind + "pos, trail = res")
+                self._addGoto(lines, ind, rule, state.targets)
+
+            elif state.kind == _State.SWITCH:
+                add(ind + "if pos >= n:")
+                add(ind + "    st.atEnd = True")
+                add(ind + "    break")
+                add(ind + "keyword = masks[pos] & _KEYWORDS")
+                add(ind + "keyword &= -keyword # <- erstes Schlüsselwort")
+                branchKeyword = 'if'
+                for mask, targets in state.branches:
+                    add(ind + "%s keyword == %d:" % (branchKeyword, mask))
+                    branchKeyword = 'elif'
+                    self._addGoto(lines, ind + '    ', rule, targets)
+                add(ind + "else:")
+                add(ind + "    st.atEnd = False")
+                add(ind + "    break")
+
+            else: # Regelende
+                add(ind + "yield pos, ((_END, %d), trail)" % rule.transform)
+                add(ind + "break")
+
+        return '\n'.join(lines) + '\n'
+
+    def _addGoto(self, lines, ind, rule, targets):
+
+        if not targets:
+            lines.append(ind + "st.atEnd = pos >= n")
+            lines.append(ind + "break")
+            return
+
+        # Alternativen für das Backtracking merken. Für Tokenknoten, die
+        # nicht zum aktuellen Token passen, nur den Fehlschlag (Zustand -1):
+        # Wie bei Parser zählt die Art des zuletzt gescheiterten Versuchs.
+        for target in reversed(targets[1:]):
+            state = rule.states[target]
+            if state.kind == _State.TOKEN:
+                lines.append(ind + "if pos < n and masks[pos] & %d:"
+                             % state.mask)
+                lines.append(ind + "    stack.append((%d, pos, trail, None))"
+                             % target)
+                lines.append(ind + "else:")
+                lines.append(ind + "    stack.append((-1, pos, None, None))")
+            else:
+                lines.append(ind + "stack.append((%d, pos, trail, None))"
+                             % target)
+        lines.append(ind + "state = %d" % targets[0])
+
+class _RuleCode(object):
+
+    def __init__(self, name, transform):
+
+        self.name = name
+        self.transform = transform # <- Index in _TRANSFORMS, -1: keine
+        self.entry = []
+        self.states = []
+
+    def getSignature(self):
+
+        return (self.name, self.transform, tuple(self.entry),
+                tuple([state.getSignature() for state in self.states]))
+
+class _State(object):
+
+    TOKEN = 1
+    CALL = 2
+    SWITCH = 3
+    END = 4
+
+    def __init__(self, kind, index, node):
+
+        self.kind = kind
+        self.index = index
+        self.node = node
+        self.targets = []
+
+    def getSignature(self):
+
+        if self.kind == _State.TOKEN:
+            return (self.kind, self.mask, self.id, tuple(self.targets))
+        elif self.kind == _State.CALL:
+            return (self.kind, self.name, self.id, tuple(self.targets))
+        elif self.kind == _State.SWITCH:
+            return (self.kind, tuple([(mask, tuple(targets))
+                                      for mask, targets in self.branches]))
+        else:
+            return (self.kind,)
+
+class _StateBuilder(object):
+
+    # Zustände einer Regel: Tokenknoten, Aufrufe anderer Regeln, Switches und
+    # das Regelende. Technische Knoten werden aufgelöst (Ziele eines Zustands
+    # in Suchreihenfolge).
+
+    def __init__(self, typeTable, end):
+
+        self._typeTable = typeTable
+        self._end = end
+        self._states = []
+        self._stateIndexes = {}
+        self._pending = []
+
+    def getTargets(self, successors):
+
+        res = self._resolve(successors, set())
+
+        while self._pending:
+            state = self._pending.pop(0)
+            self._initState(state)
+
+        return res
+
+    def getStates(self):
+
+        return self._states
+
+    def _resolve(self, successors, visiting):
+
+        res = []
+        for node in successors:
+            if self._isState(node):
+                res.append(self._getState(node).index)
+            else:
+                if node in visiting:
+                    raise CodeGenerationError('Cycle without tokens')
+                nodeSuccessors = node.getStaticSuccessors()
+                if nodeSuccessors is None:
+                    raise CodeGenerationError(
+                        "Unsupported node type: %s" % type(node).__name__)
+                visiting.add(node)
+                res.extend(self._resolve(nodeSuccessors, visiting))
+                visiting.discard(node)
+
+        return res
+
+    def _isState(self, node):
+
+        if isinstance(node, _ConditionalNode):
+            raise CodeGenerationError('Conditions are not supported')
+
+        return node is self._end or node.isTokenNode() or \
+            node.isRuleStart() or isinstance(node, _SwitchNode)
+
+    def _getState(self, node):
+
+        if node in self._stateIndexes:
+            return self._states[self._stateIndexes[node]]
+
+        if node is self._end:
+            kind = _State.END
+        elif node.isTokenNode():
+            kind = _State.TOKEN
+        elif node.isRuleStart():
+            kind = _State.CALL
+        else:
+            kind = _State.SWITCH
+
+        state = _State(kind, len(self._states), node)
+        self._states.append(state)
+        self._stateIndexes[node] = state.index
+        self._pending.append(state)
+
+        return state
+
+    def _initState(self, state):
+
+        node = state.node
+
+        if state.kind == _State.TOKEN:
+            tokenType = node.getTokenType()
+            state.mask = self._typeTable.getMask(tokenType)
+            state.id = node.getId()
+            state.description = _describe(tokenType)
+            state.targets = self._resolve(node.getStaticSuccessors(), set())
+        elif state.kind == _State.CALL:
+            state.name = node.getName()
+            state.id = node.getId()
+            state.targets = self._resolve(
+                node.getEndNode().getStaticSuccessors(), set())
+        elif state.kind == _State.SWITCH:
+            branches = []
+            for keyword, socket in node.getBranches():
+                branches.append((self._typeTable.getMask(keyword),
+                                 self._resolve([socket], set())))
+            branches.sort()
+            state.branches = branches
+
+class _ContextRead(Exception):
+
+    pass
+
+class _GeneratorContext(object):
+
+    def setToken(self, token):
+
+        raise _ContextRead
+
+    def getToken(self):
+
+        raise _ContextRead
+
+    token = property(getToken)
+
+    def getEnvVar(self, name):
+
+        raise _ContextRead
+
+    def __getitem__(self, name):
+
+        raise _ContextRead
+
+    def getCurKeyword(self):
+
+        raise _ContextRead
+
+def _describe(tokenType):
+
+    # Literal und Trenner aus Separator.create haben kein Muster:
+    if isinstance(tokenType, Keyword):
+        return "Keyword %r" % tokenType.getKeyword()
+    elif tokenType.getPattern() is None:
+        return type(tokenType).__name__
+    else:
+        return "%s %r" % (type(tokenType).__name__, tokenType.getPattern())
+
+_HEADER = """\
+# coding=UTF-8
+
+# Von tbparser.codegen aus der Grammatik '%(grammar)s' erzeugt. Nicht von Hand
+# ändern.
+
+from tbparser import parser as _parser
+from tbparser.parser import AstNode, ParseError"""
+
+_HELPERS = """
+TOKEN_TYPE_COUNT = %(typeCount)d
+_KEYWORDS = %(keywordMask)d # <- Bits der Schlüsselwörter
+
+_TOKEN = 0
+_START = 1
+_END = 2
+
+_TRANSFORMS = %(transforms)s
+
+class Parser(_parser.Parser):
+
+    # Parser mit dem Lexer der Grammatik, die Tokens werden aber vom
+    # erzeugten Code verarbeitet.
+
+    def __init__(self, grammar):
+
+        _parser.Parser.__init__(self, grammar)
+
+        if grammar.getTokenTypeTable().getSize() != TOKEN_TYPE_COUNT:
+            raise Exception('Grammar does not match generated parser')
+
+    def _parseTokens(self, tokens):
+
+        return parseTokens(tokens, self._curFile)
+
+def parseTokens(tokens, filePath=None):
+
+    st = _ParseState(tokens)
+
+    for pos, trail in _rule0(st, 0,
+                             ((_START, %(rootName)r, %(rootId)r), None)):
+        if pos == st.n:
+            return _createAst(st.tokens, trail)
+        st.atEnd = False # <- Übriges Token passt nicht
+
+    # Wie bei Parser: Fehler am weitesten gelesenen Token, außer der letzte
+    # Versuch scheiterte am Ende der Eingabe
+    if not st.atEnd:
+        token = st.tokens[min(st.maxPos, st.n - 1)]
+        line, column = token.getStartPosition()
+        raise ParseError(filePath, line, column, token.getText())
+    else:
+        raise Exception("Parsing error")
+
+class _ParseState(object):
+
+    def __init__(self, tokens):
+
+        self.tokens = list(tokens)
+        self.masks = [token.getTypeMask() for token in self.tokens]
+        self.n = len(self.tokens)
+        self.maxPos = 0 # <- Anzahl Tokens der längsten Ableitung
+        self.atEnd = False # <- Letzter Fehlschlag am Ende der Eingabe
+
+def _createAst(tokens, trail):
+
+    # trail: verkettete Liste der Ereignisse (Regelstart, Token, Regelende)
+    events = []
+    while trail:
+        events.append(trail[0])
+        trail = trail[1]
+    events.reverse()
+
+    stack = []
+    current = None
+
+    for event in events:
+
+        if event[0] == _START:
+            if current:
+                stack.append(current)
+            current = AstNode(event[1], '', event[2])
+
+        elif event[0] == _END:
+            if event[1] >= 0:
+                tmp = current
+                current = _TRANSFORMS[event[1]](current)
+                if current is not tmp:
+                    current.setId(tmp.getId())
+            parent = stack and stack.pop() or None
+            if parent:
+                parent.addChild(current)
+                current = parent
+            else:
+                break
+
+        else:
+            text = tokens[event[2]].getText()
+            current.addChild(AstNode('token', text, event[1]))
+
+    return current
+"""
@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with TBParser.  If not, see <http://www.gnu.org/licenses/>.
 
+from tbparser.token import TokenTypeTable
+
 # ===== Interne Objekte: =====
 
 class Connectable(object):
@@ -76,6 +78,7 @@ class Rule(Connectable, Pluggable, GrammarElement):
         self._start = RuleStartNode(self, name, identifier)
         self._end = RuleEndNode(self)
         self._envVars = {}
+        self._contextIndependent = False
 
     def expand(self, start, end, context):
         
@@ -105,6 +108,16 @@ class Rule(Connectable, Pluggable, GrammarElement):
     def setEnvVar(self, name, value=True):
 
         self._envVars[name] = value
+        
+    # Hängt expand nicht vom Kontext ab, wird die Regel nur einmal expandiert
+    # und ihr Teilgraph bei jedem Besuch wiederverwendet:
+    def setContextIndependent(self, independent=True):
+        
+        self._contextIndependent = independent
+        
+    def isContextIndependent(self):
+        
+        return self._contextIndependent
 
     def getSocket(self):
 
@@ -133,6 +146,8 @@ class initialize(object):
     def __call__(self, initFunc):
         
         self._ruleFactory._initFunc = initFunc
+        
+        return initFunc
 
 class expand(object):
     
@@ -143,6 +158,8 @@ class expand(object):
     def __call__(self, expandFunc):
         
         self._ruleFactory._expandFunc = expandFunc
+        
+        return expandFunc
 
 class transform(object):
     
@@ -153,6 +170,8 @@ class transform(object):
     def __call__(self, transformFunc):
         
         self._ruleFactory._transformFunc = transformFunc
+        
+        return transformFunc
 
 class Grammar(Rule):
 
@@ -161,10 +180,20 @@ class Grammar(Rule):
         Rule.__init__(self)
 
         self._tokenTypes = tokenTypes
+        # Dichte Nummerierung 0..N-1 je Grammatik (statt der globalen IDs):
+        self._typeTable = TokenTypeTable(tokenTypes)
 
     def getTokenTypes(self):
 
         return self._tokenTypes
+    
+    def getTokenTypeTable(self):
+        
+        return self._typeTable
+    
+    def getTokenTypeIndex(self, tokenType):
+        
+        return self._typeTable.getIndex(tokenType)
 
 def tokenNode(tokenType, identifier=''):
 
@@ -256,6 +285,9 @@ class Condition(Connectable, Pluggable, GrammarElement):
 class SuccessorError(Exception):
     
     pass
+
+# FIRST-Menge für Knoten, deren Teilgraph nicht statisch bekannt ist:
+ANY_TOKEN_TYPE = -1
     
 # ===== Interne Objekte: =====
 
@@ -287,6 +319,14 @@ class _CustomRule(Rule):
             return self._transformFunc(astNode)
         else:
             return astNode
+        
+    def getExpandFunc(self):
+        
+        return self._expandFunc
+    
+    def getTransformFunc(self):
+        
+        return self._transformFunc
     
 class _RuleFactory(object):
     
@@ -337,6 +377,8 @@ class Node(Connectable, Socket):
 
         self._catg = category
         self._tokenType = tokenType
+        self._firstMask = None
+        self._predictions = None # <- s. setStable
         
         self.__techId = Node.__nextTechId
         Node.__nextTechId += 1
@@ -372,6 +414,72 @@ class Node(Connectable, Socket):
     def getTechnicalId(self):
         
         return self.__techId
+    
+    # Nachfolger unabhängig vom Kontext (None: nur dynamisch bestimmbar)
+    def getStaticSuccessors(self):
+        
+        return None
+    
+    # Alle direkt verbundenen Knoten, auch hinter dynamischen Verzweigungen
+    # (nur für die Analyse des Graphen):
+    def getLinkedNodes(self):
+        
+        return self.getStaticSuccessors() or []
+    
+    # Stabile Knoten bleiben über viele Besuche erhalten (Wurzel der Grammatik,
+    # wiederverwendete Expansionen). Nur für sie lohnen Vorhersagetabellen
+    # (s. Parser.compile).
+    def setStable(self):
+        
+        if self._predictions is None:
+            self._predictions = {}
+            
+    def isStable(self):
+        
+        return self._predictions is not None
+    
+    def getPredictionTable(self):
+        
+        return self._predictions
+    
+    # FIRST-Menge als Bitmaske der Tokentypen (s. TokenTypeTable): Typen der
+    # Tokenknoten, die von hier aus ohne Token erreichbar sind. Führt der Weg
+    # über dynamische Knoten, ist das Ergebnis ANY_TOKEN_TYPE.
+    def getFirstMask(self, typeTable):
+        
+        if self._firstMask is not None:
+            return self._firstMask
+        
+        self._firstMask = ANY_TOKEN_TYPE # <- Schutz vor Linksrekursion
+        
+        mask = 0
+        visited = set([self])
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.isTokenNode():
+                mask |= typeTable.getMask(node.getTokenType())
+                continue
+            if node is not self:
+                if node._firstMask is not None:
+                    mask |= node._firstMask
+                    continue
+                if node.isRuleStart():
+                    # Expansion der Regel ist ein eigener Teilgraph:
+                    mask |= node.getFirstMask(typeTable)
+                    continue
+            successors = node.getStaticSuccessors()
+            if successors is None:
+                mask = ANY_TOKEN_TYPE
+                break
+            for succ in successors:
+                if succ not in visited:
+                    visited.add(succ)
+                    stack.append(succ)
+        
+        self._firstMask = mask
+        
+        return mask
 
 class PlugNode(Node, Pluggable, Plug, GrammarElement):
 
@@ -387,6 +495,10 @@ class PlugNode(Node, Pluggable, Plug, GrammarElement):
     def getSuccessors(self, context):
 
         return self._successors
+    
+    def getStaticSuccessors(self):
+        
+        return self._successors
 
     def getPlug(self):
 
@@ -413,17 +525,97 @@ class RuleStartNode(Node, IdNode):
         self._ruleAccess = ruleAccess
         self._name = name
         self._id = identifier
+        self._staticStart = None # <- Erste Expansion, falls kontextfrei
+        self._expansion = None # <- s. Rule.setContextIndependent
+        self._detached = None # <- Noch unbenutzte Expansion (s. getFirstMask)
         
     def getSuccessors(self, context):
+        
+        if self._expansion:
+            return self._expansion
+        
+        if self._detached:
+            start = self._detached
+            self._detached = None
+            return [start]
 
         start = PlugNode(Node.TECHNICAL)
         end = PlugNode(Node.TECHNICAL)
 
-        self._ruleAccess.onSuccRequested(start, end, context)
+        if self._ruleAccess.isContextIndependent():
+            self._ruleAccess.onSuccRequested(start, end, context)
+            self._staticStart = start
+            self._expansion = [start]
+            _markStable(start, [end, self._ruleAccess.getEndNode()])
+        elif self._staticStart is None:
+            # Liest die Regel bei der ersten Expansion den Kontext nicht,
+            # hängt ihr Teilgraph nicht von ihm ab (s. getFirstMask):
+            probe = _ContextProbe(context)
+            self._ruleAccess.onSuccRequested(start, end, probe)
+            self._staticStart = not probe.wasAccessed() and start
+        else:
+            self._ruleAccess.onSuccRequested(start, end, context)
 
         end.connectTo(self._ruleAccess.getEndNode())
 
         return [start]
+    
+    def getStaticSuccessors(self):
+        
+        if self._staticStart:
+            return [self._staticStart]
+        else:
+            return None
+        
+    def getLinkedNodes(self):
+        
+        return self._expansion or [self._ruleAccess.getEndNode()]
+    
+    def isContextIndependent(self):
+        
+        return self._ruleAccess.isContextIndependent()
+    
+    def getRule(self):
+        
+        return self._ruleAccess
+    
+    def getEndNode(self):
+        
+        return self._ruleAccess.getEndNode()
+        
+    def getFirstMask(self, typeTable):
+        
+        if self._staticStart is None:
+            self._expandDetached()
+        
+        return Node.getFirstMask(self, typeTable)
+    
+    # Expansion ohne Kontext für die FIRST-Menge vor dem ersten Besuch. Liest
+    # die Regel den Kontext, bleibt die Menge unbekannt. Sonst dient die
+    # Expansion als erste beim Parsen (s. getSuccessors):
+    def _expandDetached(self):
+        
+        start = PlugNode(Node.TECHNICAL)
+        end = PlugNode(Node.TECHNICAL)
+        probe = _ContextProbe(None)
+        
+        try:
+            self._ruleAccess.onSuccRequested(start, end, probe)
+        except _NoContext:
+            pass
+        
+        if probe.wasAccessed():
+            self._staticStart = False
+            return
+        
+        end.connectTo(self._ruleAccess.getEndNode())
+        self._staticStart = start
+        
+        if self._ruleAccess.isContextIndependent():
+            self._expansion = [start]
+            _markStable(start, [end, self._ruleAccess.getEndNode()])
+        else:
+            self._detached = start
 
     def getEnvVars(self):
 
@@ -506,6 +698,24 @@ class _SwitchNode(Node):
             return [start]
         except KeyError:
             return []
+        
+    def getLinkedNodes(self):
+        
+        return [self._end]
+    
+    # Zweige als (Schlüsselwort, Socket), jeweils mit dem Ende verbunden:
+    def getBranches(self):
+        
+        res = []
+        for keyword, branch in self._branches.items():
+            branch.getPlug().connectTo(self._end)
+            res.append((keyword, branch.getSocket()))
+            
+        return res
+    
+    def getEndNode(self):
+        
+        return self._end
             
 class _ConditionalNode(Node):
     
@@ -522,6 +732,73 @@ class _ConditionalNode(Node):
             return [self._end]
         else:
             raise SuccessorError
+        
+    def getLinkedNodes(self):
+        
+        return [self._end]
+        
+# Markiert den Teilgraph ab start bis zu den Endknoten ends als stabil. Hinter
+# dem Regelende liegt der Graph des Aufrufers, der bei jeder Expansion des
+# Aufrufers neu entstehen kann:
+def _markStable(start, ends):
+    
+    for end in ends:
+        end.setStable()
+        
+    stack = [start]
+    while stack:
+        node = stack.pop()
+        if not node.isStable():
+            node.setStable()
+            stack.extend(node.getLinkedNodes())
+
+class _NoContext(Exception):
+    
+    pass
+
+class _ContextProbe(object):
+    
+    # Reicht Zugriffe an den Kontext durch und merkt sich, ob es welche gab.
+    # Ohne Kontext (None) bricht jeder Zugriff die Expansion ab.
+    
+    def __init__(self, context):
+        
+        self._context = context
+        self._accessed = False
+        
+    def wasAccessed(self):
+        
+        return self._accessed
+    
+    def setToken(self, token):
+        
+        self._access().setToken(token)
+    
+    def getToken(self):
+        
+        return self._access().getToken()
+    
+    token = property(getToken)
+    
+    def getEnvVar(self, name):
+        
+        return self._access().getEnvVar(name)
+    
+    def __getitem__(self, name):
+        
+        return self.getEnvVar(name)
+    
+    def getCurKeyword(self):
+        
+        return self._access().getCurKeyword()
+    
+    def _access(self):
+        
+        self._accessed = True
+        if self._context is None:
+            raise _NoContext
+        
+        return self._context
 
 class RuleInternalAccess(object):
     
@@ -537,6 +814,9 @@ class RuleInternalAccess(object):
     def getEnvVars(self):
         raise NotImplementedError
     
+    def isContextIndependent(self):
+        raise NotImplementedError
+    
     def onSuccRequested(self, start, end, context):
         raise NotImplementedError
     
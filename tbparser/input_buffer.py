@@ -15,42 +15,160 @@
 # You should have received a copy of the GNU General Public License
 # along with TBParser.  If not, see <http://www.gnu.org/licenses/>.
 
+from array import array
+import bisect
+
 class InputBuffer(object):
     
-    def __init__(self, stream, fillSize=1):
+    CHUNK_SIZE = 8192
+    HISTORY_SIZE = 1 # <- Zeichen vor der Leseposition, die erhalten bleiben
+    
+    def __init__(self, stream, fillSize=1, chunkSize=CHUNK_SIZE):
         
         self._stream = stream
         self._fillSize = fillSize
-        self._content = ""
+        self._chunkSize = max(chunkSize, fillSize)
+        # Gelesener Text und Leseposition darin. Bereits konsumierte Zeichen
+        # werden erst beim nächsten Nachladen verworfen:
+        self._buffer = ""
+        self._pos = 0
+        self._offset = 0 # <- Position von _buffer[0] in der Eingabe
+        self._lineIndex = LineIndex()
+        
+    def setFillSize(self, fillSize):
+        
+        self._fillSize = fillSize
+        self._chunkSize = max(self._chunkSize, fillSize)
+    
+    def getFillSize(self):
+        
+        return self._fillSize
     
     def getContent(self):
         
-        self._fillContent()
+        return self.peek(self._fillSize)
+    
+    def peek(self, size):
         
-        return self._content
-                
-    def consumeChar(self):
+        self._fillContent(size)
         
-        res = ''
+        return self._buffer[self._pos:self._pos + size]
+    
+    def read(self, size):
         
-        if len(self._content):
-            
-            res = self._content[0]
-            self._content = self._content[1:]
-            self._fillContent()
+        res = self.peek(size)
+        self._pos += len(res)
         
         return res
+                
+    def consumeChar(self):
+        
+        return self.read(1)
         
     def consumeAll(self):
                 
-        res = self._content
-        self._content = ""
+        res = self._buffer[self._pos:self._pos + self._fillSize]
+        self._pos += len(res)
         
         return res
         
-    def _fillContent(self):
+    # Direkter Zugriff auf den gepufferten Text für Scanner, die selbst
+    # darin suchen: getText()[getPosition():] ist noch nicht konsumiert.
+    
+    def getText(self):
+        
+        return self._buffer
+    
+    def getPosition(self):
+        
+        return self._pos
+    
+    def setPosition(self, pos):
+        
+        self._pos = pos
+        
+    def getOffset(self):
+        
+        return self._offset
+    
+    def getLineIndex(self):
+        
+        return self._lineIndex
+    
+    def loadMore(self):
+        
+        # Nach dem Nachladen ändern sich Text und Position!
+        available = len(self._buffer) - self._pos
+        
+        return self._load(available + 1) > available
+        
+    def _fillContent(self, size):
+        
+        if len(self._buffer) - self._pos < size:
+            self._load(size)
         
-        while len(self._content) < self._fillSize:
-            if self._stream.endOfInput():
+    def _load(self, size):
+        
+        keep = min(self._pos, InputBuffer.HISTORY_SIZE)
+        start = self._pos - keep
+        available = len(self._buffer) - self._pos
+        
+        chunks = [self._buffer[start:]]
+        chunkOffset = self._offset + len(self._buffer)
+        while available < size:
+            chunk = self._stream.read(max(self._chunkSize, size - available))
+            if not chunk:
                 break
-            self._content += self._stream.getNextChar()
+            self._lineIndex.addText(chunk, chunkOffset)
+            chunks.append(chunk)
+            available += len(chunk)
+            chunkOffset += len(chunk)
+        
+        self._buffer = "".join(chunks)
+        self._pos = keep
+        self._offset += start
+        
+        return available
+
+class SourceBuffer(InputBuffer):
+    
+    # Puffer über einen vollständig vorliegenden Text (String oder
+    # Memory-Mapping, s. InStream.getSource): kein Kopieren, kein Nachladen.
+    
+    def __init__(self, source):
+        
+        InputBuffer.__init__(self, None)
+        
+        self._buffer = source
+        self._lineIndex.addText(source, 0)
+        
+    def _load(self, size):
+        
+        return len(self._buffer) - self._pos
+    
+class LineIndex(object):
+    
+    # Zeilenanfänge (Offsets) der bisher gelesenen Eingabe. Zeile und Spalte
+    # werden erst bei Bedarf daraus berechnet.
+    
+    def __init__(self):
+        
+        self._lineStarts = array('l', [0])
+        
+    def addText(self, text, offset):
+        
+        lineStarts = self._lineStarts
+        idx = text.find('\n')
+        while idx >= 0:
+            lineStarts.append(offset + idx + 1)
+            idx = text.find('\n', idx + 1)
+            
+    def getLineStarts(self):
+        
+        return self._lineStarts
+            
+    def getPosition(self, offset):
+        
+        line = bisect.bisect_right(self._lineStarts, offset)
+        
+        return line, offset - self._lineStarts[line - 1] + 1
@@ -15,6 +15,10 @@
 # You should have received a copy of the GNU General Public License
 # along with TBParser.  If not, see <http://www.gnu.org/licenses/>.
 
+import codecs
+import mmap
+import os
+
 class InStream(object):
     
     def __init__(self):
@@ -25,6 +29,46 @@ class InStream(object):
     
     def endOfInput(self):
         return True
+    
+    # Liest bis zu size Zeichen ('' => Ende der Eingabe). Die Standard-
+    # implementierung adaptiert Streams, die nur getNextChar/endOfInput
+    # implementieren:
+    def read(self, size):
+        
+        lookahead = self._getLookahead()
+        chars = [lookahead[:size]]
+        self._lookahead = lookahead[size:]
+        
+        remaining = size - len(chars[0])
+        while remaining > 0 and not self.endOfInput():
+            chars.append(self.getNextChar())
+            remaining -= 1
+            
+        return "".join(chars)
+    
+    # Wie read, aber ohne die Zeichen zu konsumieren:
+    def peek(self, size):
+        
+        lookahead = self._getLookahead()
+        if len(lookahead) < size:
+            chars = [lookahead]
+            remaining = size - len(lookahead)
+            while remaining > 0 and not self.endOfInput():
+                chars.append(self.getNextChar())
+                remaining -= 1
+            lookahead = self._lookahead = "".join(chars)
+            
+        return lookahead[:size]
+    
+    # Vollständiger, wahlfrei zugreifbarer Text ab der aktuellen Position
+    # (String oder Memory-Mapping), falls verfügbar. Sonst None:
+    def getSource(self):
+        
+        return None
+    
+    def _getLookahead(self):
+        
+        return getattr(self, '_lookahead', "")
 
 class StringInput(InStream):
 
@@ -47,52 +91,167 @@ class StringInput(InStream):
     def endOfInput(self):
         
         return self._idx >= len(self._text)
+    
+    def read(self, size):
+        
+        res = self._text[self._idx:self._idx + size]
+        self._idx += len(res)
+        
+        return res
+    
+    def peek(self, size):
+        
+        return self._text[self._idx:self._idx + size]
+    
+    def getSource(self):
+        
+        if self._idx == 0 and self._text:
+            return self._text
+        else:
+            return None
 
 class FileInput(InStream):
+    
+    BLOCK_SIZE = 65536
 
-    def  __init__(self, filePath):
+    def  __init__(self, filePath, encoding=None, blockSize=BLOCK_SIZE):
         
         InStream.__init__(self)
         
         self._filePath = filePath
-        self._lines = None
+        self._encoding = encoding
+        self._blockSize = blockSize
+        self._file = None
+        self._decoder = None
+        self._eof = False
+        # Aktueller Block und Leseposition darin:
+        self._block = ""
+        self._pos = 0
         
     def endOfInput(self):
 
-        if self._lines is None:
-            self._read()
-        
-        if self._curLineNum >= len(self._lines):
-            return True
-        else:
-            line = self._lines[self._curLineNum]
-            return self._curColumn >= len(line)
+        return not self._fill(1)
                 
     def getNextChar(self):
         
-        if self._lines is None:
-            self._read()
-     
-        if not self.endOfInput():
-            line = self._lines[self._curLineNum]
-            res = line[self._curColumn]
-            self._next()
-            return res
+        return self.read(1)
+        
+    def read(self, size):
+        
+        res = self.peek(size)
+        self._pos += len(res)
+        
+        return res
+    
+    def peek(self, size):
+        
+        self._fill(size)
+        
+        return self._block[self._pos:self._pos + size]
+    
+    def close(self):
+        
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._eof = True
+    
+    def _fill(self, size):
+        
+        while len(self._block) - self._pos < size and not self._eof:
+            
+            if self._file is None:
+                self._open()
+            
+            raw = self._file.read(self._blockSize)
+            if self._decoder:
+                data = self._decoder.decode(raw, not raw)
+            else:
+                data = raw
+            if not raw:
+                self.close()
+            
+            self._block = self._block[self._pos:] + data
+            self._pos = 0
+            
+        return self._pos < len(self._block)
+        
+    def _open(self):
+        
+        if self._encoding:
+            self._file = open(self._filePath, "rb")
+            self._decoder = codecs.getincrementaldecoder(self._encoding)()
         else:
-            return ''
+            self._file = open(self._filePath, "r")
+
+class MmapFileInput(FileInput):
+    
+    # Liest die Datei über ein read-only Memory-Mapping. Ohne encoding
+    # werden die Bytes direkt aus dem Mapping geliefert (ASCII-Grammatiken),
+    # sonst blockweise inkrementell dekodiert:
+    
+    def __init__(self, filePath, encoding=None, blockSize=FileInput.BLOCK_SIZE):
+        
+        FileInput.__init__(self, filePath, encoding, blockSize)
+        
+        self._size = 0
+        self._mapPos = 0
+        
+    def endOfInput(self):
+        
+        return not self.peek(1)
         
-    def _next(self):
+    def read(self, size):
         
-        line = self._lines[self._curLineNum]
-        self._curColumn += 1
-        if self._curColumn >= len(line):
-            self._curLineNum += 1
-            self._curColumn = 0
+        if self._encoding:
+            return FileInput.read(self, size)
         
-    def _read(self):
+        res = self.peek(size)
+        self._mapPos += len(res)
+        
+        return res
+    
+    def peek(self, size):
+        
+        if self._encoding:
+            return FileInput.peek(self, size)
+        
+        if self._file is None:
+            if self._eof:
+                return ""
+            self._open()
+        
+        if not self._size:
+            return ""
+        
+        return self._file[self._mapPos:self._mapPos + size]
+    
+    def getSource(self):
+        
+        if self._encoding or self._mapPos:
+            return None
+        
+        if self._file is None and not self._eof:
+            self._open()
+            
+        if self._size:
+            return self._file
+        else:
+            return None
+    
+    def _open(self):
+        
+        f = open(self._filePath, "rb")
+        self._size = os.fstat(f.fileno()).st_size
+        
+        if self._size:
+            try:
+                self._file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                f.close()
+        else:
+            # Leere Dateien lassen sich nicht mappen:
+            self._file = f
         
-        f = open(self._filePath, "r")
-        self._lines = f.readlines()
-        f.close()
-        self._curLineNum = 0
-        self._curColumn = 0
+        if self._encoding:
+            self._decoder = codecs.getincrementaldecoder(self._encoding)()
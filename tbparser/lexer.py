@@ -15,42 +15,72 @@
 # You should have received a copy of the GNU General Public License
 # along with TBParser.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
+import multiprocessing
 import re
-from tbparser.token import Token, TokenType, Keyword, \
-Word, Prefix, Postfix, Separator, Literal
-from tbparser.input_buffer import InputBuffer
+import sre_constants
+import sre_parse
+from array import array
+from tbparser.token import Token, SourceToken, BytesToken, TokenType, \
+TokenTypeTable, TokenTable, Keyword, Word, Prefix, Postfix, Separator, Literal
+from tbparser.input_buffer import InputBuffer, SourceBuffer, LineIndex
+from tbparser.instream import StringInput
+from tbparser.lexer_tables import LexerTableCache, createKey, exportRegex, \
+importRegex
 
 class Lexer(object):
     
-    def __init__(self):
+    PARALLEL_CHUNK_SIZE = 1 << 20 # <- Zeichen je Abschnitt (s. tokenizeParallel)
+    
+    # typeTable: Nummerierung der Tokentypen, z.B. die der Grammatik
+    def __init__(self, typeTable=None):
         
         self._instream = None
-        self._stack = []
-        self._keywords = {}
+        self._tokens = None # <- Generator der Tokens des Eingabestroms
+        if typeTable is None:
+            typeTable = TokenTypeTable()
+        self._typeTable = typeTable
+        self._keywords = {} # <- (ggf. in Großbuchstaben) Text -> Schlüsselwörter
+        self._foldKeywords = False # <- True, sobald es Schlüsselwörter ohne
+                                   #    Beachtung der Groß-/Kleinschreibung gibt
         self._words = []
         self._prefixes = []
         self._postfixes = []
         self._separators = []
+        self._customSeparators = []
+        self._splitRegex = None
+        self._separatorRegexes = None # <- je Trenner (Suche, Treffer), s. _splitAt
+        self._splitOnce = None # <- Trennung in einem Durchgang (s. _getTokens)
+        self._chunkRegex = None
         self._literal = None
+        self._literalRegex = None
+        self._literalMask = 0
         self._literalDelims = []
         self._literalEscChar = None
-        self._currentLitDelim = ''
-        self._wsCharCodes = [
-                             WSCharCode.TAB,
-                             WSCharCode.LINEBREAK,
-                             WSCharCode.VTAB,
-                             WSCharCode.FORMFEED,
-                             WSCharCode.SPACE
-                             ]
-        self._mode = LexerMode.NORMAL
+        self._wsCharCodes = None
+        self._wsBytes = None
+        self._wsChars = None
+        self._wsRegex = None
+        self._wsUnicode = True # <- Ausdrücke für Unicode-Eingaben (s. _scan)
+        self.setWhiteSpace(WSCharCode.DEFAULT)
         self._lineCommentEnabled = False
         self._lineCommentStart = ''
         self._blockCommentEnabled = False
         self._blockCommentStart = ''
         self._blockCommentEnd = ''
         
-        self._line = 1
-        self._column = 0
+        self._engine = LexerEngine.CLASSIC
+        self._masterRegex = None
+        self._wordRegex = None
+        self._separateWords = [] # <- Wörter außerhalb von _wordRegex
+        self._affixRegexes = None
+        self._lineIndex = None
+        self._textMode = TokenTextMode.COPY
+        self._bytesEncoding = None # <- Kodierung der Bytes (Bytes-Modus)
+        self._tokenFactory = self._createToken
+        self._unterminated = False # <- Literal/Kommentar bis Eingabeende offen
+        self._source = None # <- Vollständiger Quelltext (TokenTextMode.SOURCE)
+        self._texts = {} # <- Internierte Tokentexte (TokenTextMode.INTERN)
 
     def setInputStream(self, instream):
 
@@ -59,16 +89,81 @@ class Lexer(object):
     
     def _reset(self):
 
-        self._stack = []
+        self._tokens = None
         self._inputBuffer = None
-        self._mode = LexerMode.NORMAL
-        self._line = 1
-        self._column = 0
+        self._lineIndex = None
+        self._unterminated = False
+        self._source = None
+        self._texts = {}
+        
+    # Zustand für die Prozesse von tokenizeParallel (ohne Eingabe):
+    def __getstate__(self):
+        
+        state = self.__dict__.copy()
+        for name in ('_instream', '_tokens', '_inputBuffer', '_lineIndex', 
+                     '_tokenFactory', '_source'):
+            state[name] = None
+        state['_texts'] = {}
+            
+        return state
+    
+    def __setstate__(self, state):
+        
+        self.__dict__.update(state)
+        self._tokenFactory = self._getTokenFactory()
+
+    def setEngine(self, engine):
+        
+        self._engine = engine
+        self._masterRegex = None
+        
+    # charCodes: Zeichencodes der Whitespace-Zeichen (s. WSCharCode)
+    def setWhiteSpace(self, charCodes):
+        
+        self._wsCharCodes = sorted(set(charCodes))
+        
+        # Zeichen für Vergleiche, getrennt für Bytes und Unicode. Codes ab
+        # 0x80 gelten nur für Unicode, in Bytes wären sie Teil von
+        # Mehrbyte-Zeichen (UTF-8):
+        self._wsBytes = frozenset([chr(code) for code in self._wsCharCodes
+                                   if code < 0x80])
+        self._wsChars = frozenset([unichr(code) for code in self._wsCharCodes])
+        
+        self._wsUnicode = True
+        self._resetWhiteSpaceRegexes()
+        
+    def _resetWhiteSpaceRegexes(self):
+        
+        self._wsRegex = re.compile(r"[%s]+" % self._getWhiteSpaceClass())
+        self._masterRegex = None
+        self._chunkRegex = None
+        
+    # Bytes-Modus für ASCII-Grammatiken: Die Eingabe wird undekodiert
+    # zerlegt, der Text der Tokens (BytesToken) erst bei Bedarf mit
+    # encoding dekodiert. encoding=None beendet den Modus.
+    def setBytesMode(self, encoding='ascii'):
+        
+        self._bytesEncoding = encoding
+        self._tokenFactory = self._getTokenFactory()
+        
+    def getBytesEncoding(self):
+        
+        return self._bytesEncoding
+        
+    # s. TokenTextMode
+    def setTokenTextMode(self, mode):
+        
+        self._textMode = mode
+        self._tokenFactory = self._getTokenFactory()
 
     def addTokenType(self, tt):
         
+        self._resetRegexes()
+        
+        self._typeTable.add(tt)
+        
         if isinstance(tt, Keyword):
-            self._keywords[tt.getKeyword()] = tt
+            self._addKeyword(tt)
         elif isinstance(tt, Word):
             self._words.append(tt)
         elif isinstance(tt, Prefix):
@@ -78,19 +173,60 @@ class Lexer(object):
             self._postfixes.append(tt)
             self._postfixes.sort(cmp=TokenType.compare)
         elif isinstance(tt, Separator):
-            self._separators.append(tt)
-            self._separators.sort(cmp=TokenType.compare)
+            if tt.getPattern() is not None:
+                self._separators.append(tt)
+                self._separators.sort(cmp=TokenType.compare)
+            else:
+                self._customSeparators.append(tt)
+                self._customSeparators.sort(cmp=TokenType.compare)
         elif isinstance(tt, Literal):
             self._literal = tt
+            self._literalMask = self._typeTable.getMask(tt)
             self._literalDelims = tt.DELIMITERS
             self._literalEscChar = Literal.ESCAPE_CHAR
+            self._unescapeRegex = re.compile(r"%s([%s])" % (
+                re.escape(self._literalEscChar),
+                "".join([re.escape(d) for d in self._literalDelims])))
         else:
             raise Exception('Unknown token type')
+        
+    def getTokenTypeTable(self):
+        
+        return self._typeTable
+    
+    def _resetRegexes(self):
+        
+        self._masterRegex = None
+        self._splitRegex = None
+        self._separatorRegexes = None
+        self._splitOnce = None
+        self._chunkRegex = None
+        self._literalRegex = None
+        self._wordRegex = None
+        self._affixRegexes = None
+
+    def _addKeyword(self, keyword):
+        
+        if not keyword.isCaseSensitive() and not self._foldKeywords:
+            # Index auf Großbuchstaben umstellen:
+            self._foldKeywords = True
+            index = {}
+            for keywords in self._keywords.values():
+                for kw in keywords:
+                    key = kw.getKeyword().upper()
+                    index[key] = index.get(key, ()) + (kw,)
+            self._keywords = index
+        
+        key = keyword.getKeyword()
+        if self._foldKeywords:
+            key = key.upper()
+        self._keywords[key] = self._keywords.get(key, ()) + (keyword,)
 
     def enableLineComments(self, lineCommentStart='//'):
         
         self._lineCommentEnabled = True
         self._lineCommentStart = lineCommentStart
+        self._masterRegex = None
            
     def enableBlockComments(self, 
                             blockCommentStart='/*', 
@@ -99,22 +235,352 @@ class Lexer(object):
         self._blockCommentEnabled = True
         self._blockCommentStart = blockCommentStart
         self._blockCommentEnd = blockCommentEnd
+        self._masterRegex = None
+
+    # Zusammengesetzte Ausdrücke aus dem Cache laden bzw. dort ablegen. Erst
+    # nach addTokenType und enable...Comments aufrufen!
+    def useTableCache(self, cacheDir):
+        
+        cache = LexerTableCache(cacheDir)
+        key = self.getTablesKey()
+        
+        tables = cache.load(key)
+        if tables is not None:
+            try:
+                self.importTables(tables)
+                return True
+            except Exception:
+                # Ungültiger Eintrag => neu erzeugen:
+                self._resetRegexes()
+        
+        # Der Cache ist nur eine Beschleunigung, ohne Schreibrecht geht es
+        # auch ohne ihn:
+        try:
+            cache.save(key, self.exportTables())
+        except (IOError, OSError):
+            pass
+        
+        return False
+    
+    def getTablesKey(self):
+        
+        lineComment = self._lineCommentEnabled and self._lineCommentStart
+        blockComment = self._blockCommentEnabled and \
+            (self._blockCommentStart, self._blockCommentEnd)
+        
+        return createKey((self._engine,
+                          [word.getPattern() for word in self._words],
+                          [sep.getPattern() for sep in self._separators],
+                          [pre.getPattern() for pre in self._prefixes],
+                          [post.getPattern() for post in self._postfixes],
+                          self._literalDelims,
+                          self._literalEscChar,
+                          lineComment,
+                          blockComment,
+                          self._wsCharCodes,
+                          self._wsUnicode))
+    
+    def exportTables(self):
+        
+        tables = {'split': _exportRegex(self._getSplitRegex())}
+        if self._engine == LexerEngine.REGEX:
+            tables['master'] = _exportRegex(self._getMasterRegex())
+        else:
+            tables['chunk'] = exportRegex(self._getChunkRegex())
+        
+        tables['word'] = self._words and exportRegex(self._getWordRegex())
+        tables['separate'] = [self._words.index(word) 
+                              for word in self._separateWords]
+        tables['splitOnce'] = self._isSplitOnce()
+        prefixRegex, postfixRegex = self._getAffixRegexes()
+        tables['prefix'] = _exportRegex(prefixRegex)
+        tables['postfix'] = _exportRegex(postfixRegex)
+        
+        return tables
+    
+    def importTables(self, tables):
+        
+        self._masterRegex = _importRegex(tables.get('master'))
+        self._splitRegex = _importRegex(tables.get('split'))
+        self._chunkRegex = importRegex(tables.get('chunk'))
+        # False: kein gemeinsamer Ausdruck für die Wörter
+        self._wordRegex = importRegex(tables['word']) or False
+        self._separateWords = [self._words[idx] for idx in tables['separate']]
+        self._splitOnce = bool(tables['splitOnce'])
+        self._affixRegexes = (_importRegex(tables['prefix']), 
+                              _importRegex(tables['postfix']))
 
     def getNextToken(self):
 
         if not self._instream:
             return None
 
-        if self._stack:
-            return self._stack.pop()
+        if self._tokens is None:
+            self._tokens = self._scan()
+            
+        return next(self._tokens, None)
+    
+    # Liefert einen Generator, der die Tokens erst bei Bedarf erzeugt.
+    # getNextToken setzt ggf. an derselben Stelle fort:
+    def tokenize(self, instream):
         
-        consumed = ""
-        startLine = 0
-        startColumn = 0
+        self.setInputStream(instream)
+        self._tokens = self._scan()
+        
+        return self._tokens
+    
+    def tokenizeString(self, text):
+        
+        return self.tokenize(StringInput(text))
+    
+    # Legt die Tokens des gesamten Eingabestroms spaltenweise in einer
+    # TokenTable ab, ohne Token-Objekte zu erzeugen. Vollständig vorliegender
+    # Text wird nicht kopiert (bei Memory-Mapping verweist die Tabelle in die
+    # Abbildung, die dann geöffnet bleiben muss):
+    def tokenizeTable(self, instream):
+        
+        source = instream.getSource()
+        if source is None:
+            source = self._readAll(instream)
+            instream = StringInput(source)
+        
+        table = TokenTable(source, 
+                           self._typeTable, 
+                           self._literalMask, 
+                           self._unescape)
+        
+        self._tokenFactory = self._createEntry
+        try:
+            for mask, offset, length in self.tokenize(instream):
+                table.append(mask, offset, length)
+        finally:
+            self._tokenFactory = self._getTokenFactory()
+            
+        table.setPositions(self._lineIndex)
+        
+        return table
+    
+    # Zerlegt die Eingabe an Zeilengrenzen in Abschnitte und zerlegt diese
+    # parallel in Tokens. Endet ein Abschnitt in einem Literal oder
+    # Blockkommentar (oder schlägt er fehl), wird seriell zerlegt:
+    def tokenizeParallel(self, 
+                         instream, 
+                         numProcesses=None, 
+                         chunkSize=PARALLEL_CHUNK_SIZE):
+        
+        source = self._readAll(instream)
+        
+        bounds = []
+        start = 0
+        while start < len(source):
+            end = source.find('\n', start + chunkSize)
+            end = end >= 0 and end + 1 or len(source)
+            bounds.append((start, end))
+            start = end
+        
+        results = None
+        if len(bounds) > 1 and numProcesses != 1:
+            pool = multiprocessing.Pool(numProcesses, _initWorker, (self,))
+            try:
+                results = pool.map(_tokenizeChunk, 
+                                   [source[start:end] for start, end in bounds])
+            finally:
+                pool.close()
+                pool.join()
+                
+        if not results or None in results:
+            return self.tokenize(StringInput(source))
+        
+        self.setInputStream(StringInput(source))
+        self._source = source
+        self._lineIndex = LineIndex()
+        self._lineIndex.addText(source, 0)
+        self._tokens = self._mergeChunks(source, bounds, results)
+        
+        return self._tokens
+    
+    # Erneute Zerlegung nach einer Änderung von source (Entfernen von
+    # removedLength Zeichen ab offset, Einfügen von insertedText). tokens
+    # sind die Tokens zu source. Zerlegt wird ab dem letzten Token vor der
+    # Änderung, vor dem ein Whitespace steht, bis die neuen Tokens wieder
+    # mit den alten übereinstimmen. Die restlichen alten Tokens werden nur
+    # verschoben (als Kopien, tokens selbst bleibt unverändert). Liefert die
+    # Tokens zum geänderten Text.
+    def relex(self, source, tokens, offset, removedLength, insertedText):
+        
+        text = source[:offset] + insertedText + source[offset + removedLength:]
+        delta = len(insertedText) - removedLength
+        editEnd = offset + removedLength
+        newEditEnd = offset + len(insertedText)
+        
+        # Letztes Token mit Start <= offset (binäre Suche):
+        lo, hi = 0, len(tokens)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tokens[mid].getStartOffset() <= offset:
+                lo = mid + 1
+            else:
+                hi = mid
+        first = lo - 1
+        while first > 0 and not self._isWhiteSpace(
+                source[tokens[first].getStartOffset() - 1]):
+            first -= 1
+        if first > 0:
+            restart = tokens[first].getStartOffset()
+        else:
+            first = 0
+            restart = 0
+        
+        entries = []
+        idx = first # <- Kandidat unter den alten Tokens für den Gleichlauf
+        
+        self._tokenFactory = self._createEntry
+        try:
+            for mask, start, length in self.tokenize(StringInput(text[restart:])):
+                
+                start += restart
+                
+                if start >= newEditEnd:
+                    oldStart = start - delta
+                    while idx < len(tokens) and \
+                          tokens[idx].getStartOffset() < oldStart:
+                        idx += 1
+                    if idx < len(tokens) and \
+                       tokens[idx].getStartOffset() == oldStart and \
+                       oldStart > editEnd and \
+                       self._isWhiteSpace(source[oldStart - 1]):
+                        break # <- Ab hier gleiche Zerlegung wie zuvor
+                
+                entries.append((mask, start, length))
+            else:
+                idx = len(tokens)
+        finally:
+            self._tokenFactory = self._getTokenFactory()
+            self.setInputStream(None)
+        
+        lineIndex = LineIndex()
+        lineIndex.addText(text, 0)
+        self._lineIndex = lineIndex
+        self._source = text
+        
+        res = tokens[:first]
+        for mask, start, length in entries:
+            res.append(self._tokenFactory(text[start:start + length], 
+                                          mask, 
+                                          start))
+        
+        for token in tokens[idx:]:
+            token = token.copy()
+            token.setStartOffset(token.getStartOffset() + delta, lineIndex)
+            if isinstance(token, SourceToken):
+                token.setSource(text)
+            res.append(token)
+            
+        self._lineIndex = None
+        self._source = None
+            
+        return res
+    
+    def _isWhiteSpace(self, ch):
+        
+        if isinstance(ch, str):
+            return ch in self._wsBytes
+        else:
+            return ch in self._wsChars
+    
+    # Inhalt einer Zeichenklasse für die Whitespace-Zeichen (für Bytes ohne
+    # die Codes ab 0x80, s. setWhiteSpace):
+    def _getWhiteSpaceClass(self):
+        
+        if not self._wsUnicode:
+            return "".join(["\\x%02x" % code for code in self._wsCharCodes
+                            if code < 0x80])
+        
+        return "".join([code < 256 and "\\x%02x" % code or re.escape(unichr(code))
+                        for code in self._wsCharCodes])
+    
+    def _mergeChunks(self, source, bounds, results):
+        
+        for (base, _), (masks, offsets, lengths) in zip(bounds, results):
+            for idx in xrange(len(offsets)):
+                offset = base + offsets[idx]
+                yield self._tokenFactory(source[offset:offset + lengths[idx]], 
+                                         masks[idx], 
+                                         offset)
+    
+    # Im Prozess von tokenizeParallel: Tokens des Abschnitts als Spalten
+    # (Maske, Offset, Länge), None bei Fehler oder offenem Ende
+    def _tokenizeChunk(self, text):
+        
+        masks = []
+        offsets = array('i')
+        lengths = array('i')
+        
+        self._tokenFactory = self._createEntry
+        try:
+            for mask, offset, length in self.tokenize(StringInput(text)):
+                masks.append(mask)
+                offsets.append(offset)
+                lengths.append(length)
+        except Exception:
+            return None
+        finally:
+            self._tokenFactory = self._getTokenFactory()
         
-        if not self._inputBuffer:
-            # Puffer erzeugen. Größe auf Zwei setzen, um evtl. Escape-Zeichen erkennen zu können
-            self._inputBuffer = InputBuffer(self._instream, fillSize=2) 
+        if self._unterminated:
+            return None
+        
+        return masks, offsets, lengths
+    
+    def _readAll(self, instream):
+        
+        chunks = []
+        while True:
+            chunk = instream.read(InputBuffer.CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            
+        return "".join(chunks)
+    
+    def _scan(self):
+        
+        # Vollständig vorliegender Text (auch Memory-Mapping) wird direkt
+        # durchsucht:
+        source = self._instream.getSource()
+        
+        if self._textMode == TokenTextMode.SOURCE:
+            # Tokens verweisen in den Quelltext (bei Memory-Mapping in die
+            # Abbildung, die geöffnet bleiben muss, solange Texte gebraucht
+            # werden). Ein Eingabestrom wird vollständig gelesen:
+            if source is None:
+                source = self._readAll(self._instream)
+                self._instream = StringInput(source)
+            self._source = source
+        
+        if source is not None:
+            self._inputBuffer = SourceBuffer(source)
+        else:
+            self._inputBuffer = InputBuffer(self._instream)
+        self._lineIndex = self._inputBuffer.getLineIndex()
+        
+        # Die Ausdrücke mit Whitespace-Codes ab 0x80 gelten nur für eine Art
+        # der Eingabe (Bytes oder Unicode), bei Wechsel neu erzeugen:
+        isUnicode = isinstance(self._inputBuffer.peek(1), unicode)
+        if isUnicode != self._wsUnicode and self._wsCharCodes and \
+           self._wsCharCodes[-1] >= 0x80:
+            self._wsUnicode = isUnicode
+            self._resetWhiteSpaceRegexes()
+        
+        if self._engine == LexerEngine.REGEX:
+            return self._scanRegex()
+        else:
+            return self._scanClassic()
+    
+    def _scanClassic(self):
+        
+        consumed = ""
+        startOffset = 0
                 
         while True:
             
@@ -123,274 +589,712 @@ class Lexer(object):
             if not content:
                 break
             
+            # Kommentare werden nur am Anfang eines Abschnitts erkannt:
+            if not consumed and self._skipComment():
+                continue
+            
+            offset = self._inputBuffer.getOffset() + \
+                self._inputBuffer.getPosition()
             consumedChars, isTermination = self._consume()
-            curStartPos = self._updatePosInfo(consumedChars)
-
-            if self._mode == LexerMode.NORMAL:
 
-                if not consumed and curStartPos:
-                    startLine = curStartPos[0]
-                    startColumn = curStartPos[1]
+            if not consumed and consumedChars:
+                startOffset = offset
 
-                consumed += consumedChars
+            consumed += consumedChars
                         
             if isTermination:
-                
-                if self._mode == LexerMode.NORMAL:
-                    
-                    res = self._handleComsumption(consumed, startLine, startColumn)
-                    if res:
-                        return res
-                    else:
-                        consumed = ""
-                                    
-                else: # Kommentarmodus => Moduswechsel mit Content prüfen
-                    
-                    self._checkForModeChange(content)
+                for token in self._handleComsumption(consumed, startOffset):
+                    yield token
+                consumed = ""
                 
         if consumed:
-            return self._handleComsumption(consumed, startLine, startColumn)
+            for token in self._handleComsumption(consumed, startOffset):
+                yield token
+        
+    def _skipComment(self):
+        
+        buf = self._inputBuffer
+        
+        if self._lineCommentEnabled and \
+           buf.peek(len(self._lineCommentStart)) == self._lineCommentStart:
+            start, end = self._lineCommentStart, '\n'
+        elif self._blockCommentEnabled and \
+             buf.peek(len(self._blockCommentStart)) == self._blockCommentStart:
+            start, end = self._blockCommentStart, self._blockCommentEnd
         else:
-            return None
+            return False
         
-    def _updatePosInfo(self, content):
+        buf.read(len(start))
         
-        res = None
+        # Ende im gepufferten Text suchen, ggf. nachladen. Ein nicht
+        # abgeschlossener Kommentar reicht bis zum Ende der Eingabe:
+        while True:
+            text = buf.getText()
+            pos = buf.getPosition()
+            idx = text.find(end, pos)
+            if idx >= 0:
+                buf.setPosition(idx + len(end))
+                break
+            # Mögliche Teiltreffer am Pufferende nicht überspringen:
+            buf.setPosition(max(pos, len(text) - len(end) + 1))
+            if not buf.loadMore():
+                buf.setPosition(len(buf.getText()))
+                self._unterminated = True
+                break
         
-        for i in range(len(content)):
+        return True
+  
+    def _getTokens(self, text, startOffset):
+
+        splitOnce = self._isSplitOnce()
+        res = []
+        pos = 0
+        
+        # Literale und Trenner in einem Durchgang finden. Literale sind
+        # unteilbar, ihre Tokens entstehen erst in _getPieceTokens. Bei
+        # einzelnen Trennzeichen ohne Kontextbedingungen ändert die
+        # Reihenfolge der Trenner nichts, es wird direkt an allen Treffern
+        # getrennt:
+        for match in self._getSplitRegex().finditer(text):
             
-            ch = content[i]
-            if not ord(ch) == WSCharCode.LINEBREAK:
-                self._column += 1
-            else:
-                self._line += 1
-                self._column = 0
-                
-            if i == 0:
-                res = (self._line, self._column)
+            kind = match.lastgroup
+            if kind == 'lit':
+                continue
             
+            start, end = match.span()
+            if end != start + 1 or not splitOnce:
+                break
+            
+            if start > pos:
+                res += self._getPieceTokens(text[pos:start], startOffset + pos)
+            res.append(self._tokenFactory(match.group(kind), 
+                                          self._getMask(kind), 
+                                          startOffset + start))
+            pos = end
+            
+        else:
+            if pos < len(text):
+                res += self._getPieceTokens(text[pos:], startOffset + pos)
+            return res
+        
+        literals = [match.span() for match in self._getSplitRegex().finditer(text)
+                    if match.lastgroup == 'lit']
+        res = []
+        self._splitAt(text, startOffset, 0, literals, res)
+        
         return res
+    
+    def _isSplitOnce(self):
+        
+        if self._splitOnce is None:
+            self._splitOnce = not [sep for sep in self._separators
+                                   if _dependsOnContext(sep.getPattern())]
+            
+        return self._splitOnce
+    
+    # Trennt wie früher nach Priorität der Trenner (s. TokenType.compare):
+    # Zuerst an allen Vorkommen des ersten Trenners ab sepIdx, den es im
+    # Text gibt, dann die Teile an den übrigen. literals: Spannen der
+    # Literale in text, in denen nicht getrennt wird.
+    def _splitAt(self, text, offset, sepIdx, literals, res):
         
-    def _checkForModeChange(self,consumed):
+        separatorRegexes = self._getSeparatorRegexes()
+        
+        for idx in xrange(sepIdx, len(separatorRegexes)):
+            
+            spans = self._findSeparators(text, separatorRegexes[idx], literals)
+            if not spans:
+                continue
+            
+            mask = self._typeTable.getMask(self._separators[idx])
+            pos = 0
+            for start, end in spans:
+                if start > pos:
+                    self._splitAt(text[pos:start], offset + pos, idx + 1, 
+                                  _getSpansWithin(literals, pos, start), res)
+                res.append(self._tokenFactory(text[start:end], 
+                                              mask, 
+                                              offset + start))
+                pos = end
+            if pos < len(text):
+                self._splitAt(text[pos:], offset + pos, idx + 1, 
+                              _getSpansWithin(literals, pos, len(text)), res)
+            return
+        
+        res += self._getPieceTokens(text, offset)
+    
+    # Vorkommen eines Trenners außerhalb der Literale, von rechts nach links
+    # bestimmt (wie früher mit \A(.*)(Trenner)(.*)\Z):
+    def _findSeparators(self, text, regexes, literals):
+        
+        scanRegex, matchRegex = regexes
+        starts = [match.start() for match in scanRegex.finditer(text)]
+        
+        res = []
+        bound = len(text)
+        for start in reversed(starts):
+            if start >= bound:
+                continue
+            match = matchRegex.match(text, start, bound)
+            if not match or match.end() == start or \
+               _overlapsSpan(literals, start, match.end()):
+                continue
+            res.append(match.span())
+            bound = start
+        res.reverse()
+        
+        return res
+    
+    def _getSeparatorRegexes(self):
+        
+        if self._separatorRegexes is None:
+            self._separatorRegexes = [
+                (re.compile(r"(?=(?:%s))" % sep.getPattern()), 
+                 re.compile(sep.getPattern())) for sep in self._separators]
+            
+        return self._separatorRegexes
+    
+    def _getWordToken(self, text, startOffset):
+        
+        # Find (key)words:
+        
+        mask = 0
+        
+        if self._foldKeywords:
+            keywords = self._keywords.get(text.upper())
+        else:
+            keywords = self._keywords.get(text)
+        
+        # Schlüsselwort mit genau diesem Text vor solchen ohne Beachtung der
+        # Groß-/Kleinschreibung:
+        if keywords:
+            match = None
+            for kw in keywords:
+                if kw.isCaseSensitive():
+                    if kw.getKeyword() == text:
+                        match = kw
+                        break
+                elif match is None:
+                    match = kw
+            if match:
+                mask = self._typeTable.getMask(match)
+        
+        if self._words:
+            wordRegex = self._getWordRegex()
+            if wordRegex:
+                match = wordRegex.match(text)
+                for group in match.groupdict():
+                    if match.group(group) is not None:
+                        mask |= self._getMask(group)
+            for word in self._separateWords:
+                if word.matches(text):
+                    mask |= self._typeTable.getMask(word)
+
+        if mask:
+            return self._tokenFactory(text, mask, startOffset)
+        
+        self._raiseUnknownToken(text, startOffset)
+    
+    def _handleComsumption(self, consumed, startOffset):
         
-        res = consumed
-                
         if not consumed:
-            return res
-                
-        if self._mode == LexerMode.NORMAL:
-                
-            if self._lineCommentEnabled and \
-               self._matchesCommentBegin(consumed, self._lineCommentStart):
+            return []
+        
+        tokens = self._getTokens(consumed, startOffset)
+        if not tokens:
+            self._raiseUnknownToken(consumed, startOffset)
+        
+        return tokens
+    
+    def _consume(self):
+        
+        # Abschnitt bis zum nächsten Whitespace außerhalb von Literalen
+        # direkt im Puffer bestimmen und erst danach konsumieren:
+        buf = self._inputBuffer
+        chunkRegex = self._getChunkRegex()
+        esc = self._literalEscChar
+        scanned = 0 # <- Länge des bereits geprüften Teils
+        litDelim = None # <- Begrenzer eines noch offenen Literals
+        
+        while True:
+            
+            text = buf.getText()
+            start = buf.getPosition()
+            textLen = len(text)
+            pos = start + scanned
+            
+            while True:
                 
-                self._mode = LexerMode.LINE_COMMENT
-                self._inputBuffer = InputBuffer(self._instream,
-                                                fillSize = 1 # <- Länge von '\n'
-                                                )
+                if litDelim:
+                    idx = self._findLiteralEnd(text, pos, litDelim)
+                    if idx < 0:
+                        pos = textLen
+                        break
+                    pos = idx + 1
+                    litDelim = None
                 
-                res = ""
-                    
-            elif self._blockCommentEnabled and \
-                 self._matchesCommentBegin(consumed, self._blockCommentStart):
+                pos = chunkRegex.match(text, pos).end()
+                if pos == textLen:
+                    break
                 
-                self._mode = LexerMode.BLOCK_COMMENT
-                size = len(self._blockCommentEnd);
-                self._inputBuffer = InputBuffer(self._instream,
-                                                fillSize = size
-                                                )
-                res = ""
+                ch = text[pos]
+                if ch in self._literalDelims:
+                    litDelim = ch
+                    pos += 1
+                elif ch == esc:
+                    # Escape-Zeichen maskieren das jeweils folgende Zeichen
+                    # (am Pufferende erst nach dem Nachladen entscheidbar):
+                    end = pos
+                    while end < textLen and text[end] == esc:
+                        end += 1
+                    if end == textLen:
+                        break
+                    pos = end + 1
+                else:
+                    # Folgenden Whitespace am Stück mit konsumieren:
+                    end = self._wsRegex.match(text, pos).end()
+                    buf.read(end - start)
+                    return text[start:pos], True
                 
-        else:
-            
-            self._mode = LexerMode.NORMAL
-            self._inputBuffer = InputBuffer(self._instream,
-                                            fillSize = 2 # <- Länge zwei wg. Escape-Zeichen
-                                            )
-            res = ""
+            scanned = pos - start
+            if not buf.loadMore():
+                self._unterminated = litDelim is not None
+                buf.read(textLen - start)
+                return text[start:], False
+    
+    def _getPieceTokens(self, text, offset):
         
-        return res
-  
-    def _getTokens(self, text, startLine, startColumn):
-
-        # Handle literals:
-        if self._literal:
-            token = self._literal.createToken(text)
-            if token:
-                token.setStartPosition(startLine, startColumn)
-                return [token]
+        # Text ohne Whitespace und Trenner => Präfixe/Postfixe abspalten,
+        # Rest muss ein Literal oder (Schlüssel-)Wort sein. Trenner ohne
+        # eigenes Muster (s. Separator.create) können nur hier erkannt
+        # werden:
         
-        res = []
-
-        # Find separators and split:
-        for sep in self._separators:
-
+        if self._isLiteral(text):
+            return [self._tokenFactory(text, self._literalMask, offset)]
+        
+        for sep in self._customSeparators:
+            
             token = sep.createToken(text)
-
+            
             if token:
-                # Reihenfolge wg. POP-Logik vertauschen...
-                right = sep.getRemainingRight(text)
                 left = sep.getRemainingLeft(text)
-                
-                if right:
-                    col = startColumn + len(left) + len(token.getText())
-                    res = self._getTokens(right, startLine, col)
-                    
-                token.setStartPosition(startLine, startColumn + len(left))
-
-                res.append(token)
-                
-                if left:
-                    res += self._getTokens(left, startLine, startColumn)
-
-                return res
-
-        # Find prefixes:
-        for prefix in self._prefixes:
-
-            token = prefix.createToken(text)
-
-            if token:
-
-                right = prefix.getRemainingRight(text)
+                right = sep.getRemainingRight(text)
+                res = left and self._getPieceTokens(left, offset) or []
+                pos = offset + len(left)
+                res.append(self._tokenFactory(token.getText(), 
+                                              self._typeTable.getMask(sep), 
+                                              pos))
                 if right:
-                    col = startColumn + len(token.getText())
-                    res = self._getTokens(right, startLine, col)
-                    
-                token.setStartPosition(startLine, startColumn)
-
-                res.append(token)
-
+                    pos += len(token.getText())
+                    res += self._getPieceTokens(right, pos)
                 return res
-
-        # Find postfixes:
-        for postfix in self._postfixes:
-
-            token = postfix.createToken(text)
-
-            if token:
+        
+        left = []
+        right = []
+        
+        if self._prefixes or self._postfixes:
+            
+            prefixRegex, postfixRegex = self._getAffixRegexes()
+            
+            while not self._isLiteral(text):
                 
-                left = postfix.getRemainingLeft(text)
+                match = prefixRegex and prefixRegex.match(text)
+                if match:
+                    size = match.end()
+                    left.append(self._tokenFactory(text[:size], 
+                                                   self._getMask(match.lastgroup), 
+                                                   offset))
+                    text = text[size:]
+                    offset += size
+                    continue
                 
-                col = startColumn + len(left)
-                token.setStartPosition(startLine, col)
-
-                res.append(token)
-
-                if left:
-                    res += self._getTokens(left, startLine, startColumn)
-
-                return res 
-
-        # Find (key)words:
+                match = postfixRegex and postfixRegex.search(text)
+                if match:
+                    start = match.start()
+                    right.append(self._tokenFactory(text[start:], 
+                                                    self._getMask(match.lastgroup), 
+                                                    offset + start))
+                    text = text[:start]
+                    continue
+                
+                break
+            
+            else:
+                left.append(self._tokenFactory(text, self._literalMask, offset))
+                right.reverse()
+                
+                return left + right
         
-        try:
-            matchingWords = [self._keywords[text]]
-        except KeyError:
-            # maybe case insensitive keyword?
-            try:
-                kw = self._keywords[text.upper()]
-                if not kw.isCaseSensitive():
-                    matchingWords = [kw]
-                else:
-                    matchingWords = []
-            except KeyError:
-                matchingWords = []
+        left.append(self._getWordToken(text, offset))
+        right.reverse()
         
-        matchingWords += [word for word in self._words if word.matches(text)]
-
-        if matchingWords:
-            token = Token(text, matchingWords)
-            token.setStartPosition(startLine, startColumn)
-            res.append(token)
-            return res
+        return left + right
+    
+    # Erzeugung der Tokens aus dem Quelltext des Tokens (Literale noch mit
+    # Escape-Zeichen):
+    def _createToken(self, text, mask, offset):
+        
+        if mask == self._literalMask:
+            text = self._unescape(text)
         
-        raise Exception("Unknown token '%s' at line %d, column %d" % (text, startLine, startColumn))
+        return Token(text, mask, self._typeTable, offset, self._lineIndex)
     
-    def _handleComsumption(self, consumed, startLine, startColumn):
+    def _createInternedToken(self, text, mask, offset):
         
-        consumed = self._checkForModeChange(consumed)
-                
-        if consumed:
-            self._stack = self._getTokens(consumed, startLine, startColumn)
-            if self._stack:
-                return self._stack.pop()
-            else:
-                raise Exception("Unknown token '%s' at line %d, column %d" \
-                                % (consumed, startLine, startColumn))
+        if mask == self._literalMask:
+            text = self._unescape(text)
+        text = self._texts.setdefault(text, text)
         
-        return None
+        return Token(text, mask, self._typeTable, offset, self._lineIndex)
     
-    def _consume(self):
-
-        text = self._inputBuffer.getContent()
-        if not text:
-            raise Exception('Must not consume empty content')
+    def _createSourceToken(self, text, mask, offset):
         
-        if self._mode == LexerMode.NORMAL:
-
-            isTermination = False
-            consumed = ''
+        # Literale ohne Escape-Zeichen behalten ihre eigene Kopie
+        if mask == self._literalMask:
+            return self._createToken(text, mask, offset)
+        
+        return SourceToken(self._source, 
+                           len(text), 
+                           mask, 
+                           self._typeTable, 
+                           offset, 
+                           self._lineIndex)
+    
+    def _createBytesToken(self, text, mask, offset):
+        
+        if mask == self._literalMask:
+            text = self._unescape(text)
+        
+        return BytesToken(text, 
+                          self._bytesEncoding, 
+                          mask, 
+                          self._typeTable, 
+                          offset, 
+                          self._lineIndex)
+    
+    def _getTokenFactory(self):
+        
+        if self._bytesEncoding:
+            return self._createBytesToken
+        elif self._textMode == TokenTextMode.INTERN:
+            return self._createInternedToken
+        elif self._textMode == TokenTextMode.SOURCE:
+            return self._createSourceToken
+        else:
+            return self._createToken
+    
+    def _createEntry(self, text, mask, offset):
+        
+        return mask, offset, len(text)
+    
+    def _raiseUnknownToken(self, text, offset):
+        
+        line, column = self._lineIndex.getPosition(offset)
+        
+        raise Exception("Unknown token '%s' at line %d, column %d" \
+                        % (text, line, column))
             
-            textLen = len(text)
-            lastIdx = textLen - 1
-            prevChar = None
-            for idx in range(textLen):
-                ch = text[idx]
-                if idx != lastIdx or ch != self._literalEscChar or textLen == 1:
-                    consumedChar = self._inputBuffer.consumeChar()
-                    if prevChar is None or prevChar != self._literalEscChar:
-                        isTermination = self._isWhiteSpace(consumedChar)
-                        if isTermination:
-                            break
-                        consumed += consumedChar
-                    elif consumedChar not in self._literalDelims:
-                        consumed += consumedChar
-                    else:
-                        consumed = consumed[:-1] + consumedChar
-                else:
-                    # Escape-Zeichen an letzter Position nicht konsumieren
-                    break
-                prevChar = consumedChar
+    def _getMask(self, group):
+        
+        # Gruppennamen der regulären Ausdrücke: Kennbuchstabe + Listenindex
+        kind = group[0]
+        idx = int(group[1:])
+        
+        if kind == 's':
+            tt = self._separators[idx]
+        elif kind == 'w':
+            tt = self._words[idx]
+        elif kind == 'p':
+            tt = self._prefixes[idx]
+        else:
+            tt = self._postfixes[idx]
             
-        elif self._mode == LexerMode.LINE_COMMENT:
+        return self._typeTable.getMask(tt)
+    
+    def _getAffixRegexes(self):
+        
+        if not self._affixRegexes:
             
-            isTermination = ord(text) == WSCharCode.LINEBREAK
-            consumed = self._inputBuffer.consumeAll()
-                                
-        elif self._mode == LexerMode.BLOCK_COMMENT:
+            prefixRegex = None
+            if self._prefixes:
+                prefixRegex = _compileAlternatives(
+                    [r"(?P<p%d>%s)" % (idx, prefix.getPattern())
+                     for idx, prefix in enumerate(self._prefixes)],
+                    r"(?:%s)(?=\S)")
             
-            isTermination = text == self._blockCommentEnd
-            consumed = self._inputBuffer.consumeAll()
-                        
-        else:
+            postfixRegex = None
+            if self._postfixes:
+                postfixRegex = _compileAlternatives(
+                    [r"(?P<q%d>%s)" % (idx, postfix.getPattern())
+                     for idx, postfix in enumerate(self._postfixes)],
+                    r"(?<=\S)(?:%s)\Z")
+                
+            self._affixRegexes = (prefixRegex, postfixRegex)
             
-            raise Exception("Undefined lexer mode")
+        return self._affixRegexes
+    
+    # Position des schließenden Begrenzers ab pos (-1, falls er noch nicht
+    # im Text liegt). Maskiert ist ein Begrenzer nach dem Escape-Zeichen:
+    def _findLiteralEnd(self, text, pos, delim):
+        
+        esc = self._literalEscChar
+        idx = text.find(delim, pos)
+        while idx > 0 and text[idx - 1] == esc:
+            idx = text.find(delim, idx + 1)
             
-        return consumed, isTermination
-
-    def _isWhiteSpace(self, ch):
-
-        if ch in self._literalDelims:
-            if self._currentLitDelim:
-                if ch == self._currentLitDelim:
-                    self._currentLitDelim = ""
-            else:
-                self._currentLitDelim = ch
-            return False
-        elif self._currentLitDelim:
+        return idx
+    
+    def _getChunkRegex(self):
+        
+        # Zeichen, die ohne weitere Prüfung zum Abschnitt gehören:
+        if not self._chunkRegex:
+            excl = self._getWhiteSpaceClass()
+            excl += "".join([re.escape(d) for d in self._literalDelims])
+            if self._literalEscChar:
+                excl += re.escape(self._literalEscChar)
+            self._chunkRegex = re.compile(r"[^%s]*" % excl)
+            
+        return self._chunkRegex
+    
+    def _getSplitRegex(self):
+        
+        if not self._splitRegex:
+            alternatives = self._getSeparatorPatterns()
+            if self._literal:
+                alternatives.insert(0, r"(?P<lit>%s)" % self._getLiteralPattern())
+            self._splitRegex = _compileAlternatives(alternatives or [r"(?!)"])
+        
+        return self._splitRegex
+    
+    def _getSeparatorPatterns(self):
+        
+        return [r"(?P<s%d>%s)" % (idx, sep.getPattern()) 
+                for idx, sep in enumerate(self._separators)]
+    
+    def _getLiteralPattern(self):
+        
+        # Das Escape-Zeichen maskiert nur Begrenzer. Direkt aufeinander
+        # folgende Literale mit demselben Begrenzer bilden wie früher ein
+        # einziges Literal ('it''s'):
+        esc = re.escape(self._literalEscChar)
+        delims = "".join([re.escape(d) for d in self._literalDelims])
+        literals = []
+        for delim in self._literalDelims:
+            delim = re.escape(delim)
+            literals.append(r"(?:%s(?:[^%s%s]|%s[%s]|%s(?![%s]))*%s)+" \
+                            % (delim, delim, esc, esc, delims, esc, delims, delim))
+            
+        return "|".join(literals)
+    
+    def _isLiteral(self, text):
+        
+        if self._literal is None or text[:1] not in self._literalDelims:
             return False
+        
+        if not self._literalRegex:
+            self._literalRegex = re.compile(r"(?:%s)\Z" % self._getLiteralPattern())
+            
+        return self._literalRegex.match(text) is not None
+    
+    def _unescape(self, literalText):
+        
+        if self._literalEscChar in literalText:
+            return self._unescapeRegex.sub(r"\1", literalText)
         else:
-            return ord(ch) in self._wsCharCodes
+            return literalText
+    
+    # ===== Regex-Engine: =====
+    
+    def _scanRegex(self):
+        
+        regex = self._getMasterRegex()
+        buf = self._inputBuffer
+        exhausted = False
+        commentStartLen = max(len(self._lineCommentStart), 
+                              len(self._blockCommentStart))
+        
+        while True:
+            
+            text = buf.getText()
+            pos = buf.getPosition()
+            base = buf.getOffset()
+            textLen = len(text)
+            
+            if pos == textLen:
+                if exhausted or not buf.loadMore():
+                    return
+                continue
+            
+            for match in regex.finditer(text, pos):
+                
+                start, end = match.span()
+                kind = match.lastgroup
+                
+                if start != pos:
+                    self._raiseUnknownToken(text[pos:start], base + pos)
+                
+                if kind == 'litopen' and not exhausted:
+                    # Literal bis zum Ende nachladen, dann erneut scannen:
+                    buf.setPosition(start)
+                    exhausted = not self._loadLiteral(text[start], 1)
+                    break
+                
+                if kind == 'chunk' and not exhausted and end < textLen and \
+                   text[end] in self._literalDelims:
+                    # Abschnitt mit noch offenem Literal:
+                    buf.setPosition(start)
+                    exhausted = not self._loadLiteral(text[end], 
+                                                      end - start + 1)
+                    break
+                
+                # Treffer am Pufferende kann unvollständig sein (nach einem
+                # Kommentar kann noch ein weiterer beginnen):
+                if not exhausted and \
+                   (end == textLen or kind == 'bcopen' or 
+                    kind == 'cm' and end + commentStartLen > textLen):
+                    exhausted = not self._loadMore(start)
+                    break
+                
+                pos = end
+                
+                if kind in ('ws', 'cm'):
+                    continue
+                elif kind == 'bcopen':
+                    # Nicht abgeschlossener Blockkommentar reicht bis zum Ende:
+                    self._unterminated = True
+                    buf.setPosition(textLen)
+                    break
+                elif kind == 'litopen' or end < textLen and \
+                     text[end] in self._literalDelims:
+                    # Nicht abgeschlossenes Literal reicht wie bei der
+                    # klassischen Engine bis zum Ende der Eingabe:
+                    self._unterminated = True
+                    end = pos = textLen
+                
+                for token in self._handleComsumption(text[start:end], 
+                                                     base + start):
+                    yield token
+                    
+                if pos == textLen:
+                    buf.setPosition(textLen)
+                    break
+                    
+            else:
+                buf.setPosition(textLen)
     
-    def _matchesCommentBegin(self, consumed, commentBegin):
+    # Lädt Text nach, nachdem ein Treffer ab start bis zum Pufferende
+    # reichte. Es wird mindestens so viel nachgeladen, wie ab start
+    # vorliegt, damit lange Treffer nicht bei jedem Nachladen erneut von
+    # vorn durchsucht werden. False am Ende der Eingabe.
+    def _loadMore(self, start):
+        
+        buf = self._inputBuffer
+        buf.setPosition(start)
+        available = len(buf.getText()) - start
+        buf.peek(2 * available + 1)
+        
+        return len(buf.getText()) - buf.getPosition() > available
+                
+    def _loadLiteral(self, delim, scanned):
         
-        tmp = commentBegin
-        for specialChar in ['*']:
-            tmp = tmp.replace(specialChar, '\\' + specialChar)
+        # Der öffnende Begrenzer steht scanned - 1 Zeichen hinter der
+        # Pufferposition:
+        buf = self._inputBuffer
+        
+        while True:
+            text = buf.getText()
+            start = buf.getPosition()
+            if self._findLiteralEnd(text, start + scanned, delim) >= 0:
+                return True
+            scanned = len(text) - start
+            if not self._loadMore(start):
+                return False
+                
+    def _getMasterRegex(self):
         
-        regex = r"\A%s.*\Z" % tmp
+        if self._masterRegex:
+            return self._masterRegex
         
-        return bool(re.match(regex, consumed))
+        wsChars = self._getWhiteSpaceClass()
+        alternatives = [r"(?P<ws>[%s]+)" % wsChars]
+        
+        # Kommentare wie bei der klassischen Engine nur am Anfang eines
+        # Abschnitts (am Anfang der Eingabe, nach Whitespace oder direkt
+        # nach einem anderen Kommentar): Folgen von Kommentaren bilden einen
+        # Treffer.
+        comments = []
+        starts = []
+        if self._lineCommentEnabled:
+            start = re.escape(self._lineCommentStart)
+            comments.append(r"%s[^\n]*" % start)
+            starts.append(start)
+            
+        if self._blockCommentEnabled:
+            start = re.escape(self._blockCommentStart)
+            end = re.escape(self._blockCommentEnd)
+            # Der Rumpf darf das Kommentarende nicht überspringen, sonst
+            # verlängert Backtracking einen Kommentar bis zum nächsten Ende:
+            first = re.escape(self._blockCommentEnd[0])
+            rest = re.escape(self._blockCommentEnd[1:])
+            blockComment = r"%s[^%s]*(?:%s(?!%s)[^%s]*)*%s" % (
+                start, first, first, rest, first, end)
+            comments.append(blockComment)
+            starts.append(start)
+            
+        if comments:
+            chunkStart = r"(?<![^%s])" % wsChars
+            if self._blockCommentEnabled:
+                alternatives.append(r"(?P<cm>%s(?:%s)*(?:%s)(?!%s))" % (
+                    chunkStart, blockComment, "|".join(comments), 
+                    "|".join(starts)))
+                alternatives.append(r"(?P<bcopen>%s(?:%s)*%s)" % (
+                    chunkStart, blockComment, start))
+            else:
+                alternatives.append(r"(?P<cm>%s%s)" % (chunkStart, 
+                                                       comments[0]))
+        
+        # Abschnitt bis zum nächsten Whitespace außerhalb von Literalen (wie
+        # _consume), zerlegt wird er mit _getTokens:
+        elements = []
+        excl = wsChars
+        if self._literal:
+            elements.append(self._getLiteralPattern())
+            excl += "".join([re.escape(d) for d in self._literalDelims])
+        if self._literalEscChar:
+            esc = re.escape(self._literalEscChar)
+            elements.append(r"%s+(?:[\s\S]|\Z)" % esc)
+            excl += esc
+        elements.insert(0, r"[^%s]+" % excl)
+        alternatives.append(r"(?P<chunk>(?:%s)+)" % "|".join(elements))
+        
+        if self._literal:
+            delims = "".join([re.escape(d) for d in self._literalDelims])
+            alternatives.append(r"(?P<litopen>[%s])" % delims)
+        
+        self._masterRegex = _compileAlternatives(alternatives)
+        
+        return self._masterRegex
+    
+    def _getWordRegex(self):
+        
+        # Je Wort ein optionaler Lookahead => alle passenden Wörter mit
+        # einem einzigen match-Aufruf. Wörter, die dort nicht unabhängig von
+        # den anderen wären, sowie alle Wörter bei zu vielen Gruppen für das
+        # re-Modul (None) werden einzeln geprüft:
+        if self._wordRegex is None:
+            self._separateWords = [word for word in self._words 
+                                   if _needsOwnRegex(word.getPattern())]
+            combined = [(idx, word) for idx, word in enumerate(self._words)
+                        if word not in self._separateWords]
+            try:
+                self._wordRegex = combined and re.compile("".join(
+                    [r"(?:(?=(?P<w%d>(?:%s)\Z)))?" % (idx, word.getPattern())
+                     for idx, word in combined])) or False
+            except (AssertionError, re.error):
+                self._wordRegex = False
+                self._separateWords = self._words
+        
+        return self._wordRegex or None
  
 class WSCharCode:
 
@@ -398,10 +1302,176 @@ class WSCharCode:
     LINEBREAK = 10
     VTAB = 11
     FORMFEED = 12
+    CARRIAGE_RETURN = 13
     SPACE = 32
+    
+    DEFAULT = (TAB, LINEBREAK, VTAB, FORMFEED, SPACE)
+    
+    # Leerzeichen aus Unicode (Kategorie Zs sowie NEL, LS, PS):
+    UNICODE = (0x85, 0xa0, 0x1680) + tuple(range(0x2000, 0x200b)) + \
+        (0x2028, 0x2029, 0x202f, 0x205f, 0x3000)
+
+class LexerEngine:
+    
+    CLASSIC = 1
+    REGEX = 2 # <- Ein gemeinsamer regulärer Ausdruck für alle Tokentypen
+    
+class TokenTextMode:
+    
+    COPY = 1 # <- Jedes Token mit eigenem Text
+    INTERN = 2 # <- Gleiche Texte je Eingabe nur einmal
+    SOURCE = 3 # <- Offset und Länge im Quelltext, Text erst in getText
+
+# Inline-Flags gelten im ganzen Ausdruck, Rückverweise zählen die Gruppen
+# des ganzen Ausdrucks. Muster mit beidem brauchen einen eigenen Ausdruck:
+def _needsOwnRegex(pattern):
+    
+    tree = sre_parse.parse(pattern)
+    
+    return bool(tree.pattern.flags) or tree.pattern.groups > 1
+
+# Muster, deren Treffer auch vom Text außerhalb des Treffers abhängen
+# (Anker, Lookarounds):
+def _dependsOnContext(pattern):
+    
+    stack = [sre_parse.parse(pattern)]
+    while stack:
+        for op, av in stack.pop():
+            if op in (sre_constants.AT, 
+                      sre_constants.ASSERT, 
+                      sre_constants.ASSERT_NOT):
+                return True
+            elif op == sre_constants.BRANCH:
+                stack += av[1]
+            elif op == sre_constants.SUBPATTERN:
+                stack.append(av[1])
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+                stack.append(av[2])
+            elif op == sre_constants.GROUPREF_EXISTS:
+                stack += [item for item in av[1:] if item]
+            
+    return False
+
+# spans: (start, end) aufsteigend und ohne Überlappung
+def _overlapsSpan(spans, start, end):
+    
+    idx = bisect.bisect_left(spans, (end,))
+    
+    return idx > 0 and spans[idx - 1][1] > start
+
+# Spannen innerhalb von [start, end), relativ zu start:
+def _getSpansWithin(spans, start, end):
+    
+    return [(spanStart - start, spanEnd - start) for spanStart, spanEnd in spans
+            if spanStart >= start and spanEnd <= end]
+
+# ===== Ausdrücke mit vielen Alternativen: =====
+
+MAX_GROUPS = 99 # <- Gruppen je Ausdruck im re-Modul (ohne Gruppe 0)
+
+# Übersetzt die Alternativen (template: Rahmen um die Alternation). Bei zu
+# vielen Gruppen für das re-Modul werden sie auf mehrere Ausdrücke verteilt:
+def _compileAlternatives(alternatives, template="%s"):
+    
+    try:
+        return re.compile(template % "|".join(alternatives))
+    except (AssertionError, re.error):
+        pass
+    
+    regexes = []
+    part = []
+    numGroups = 0
+    for alternative in alternatives:
+        groups = sre_parse.parse(alternative).pattern.groups - 1
+        if part and numGroups + groups > MAX_GROUPS:
+            regexes.append(re.compile(template % "|".join(part)))
+            part = []
+            numGroups = 0
+        part.append(alternative)
+        numGroups += groups
+    regexes.append(re.compile(template % "|".join(part)))
+    
+    return _AlternativesRegex(regexes)
+
+class _AlternativesRegex(object):
+    
+    # Alternation über mehrere Ausdrücke mit demselben Ergebnis wie ein
+    # einzelner: Es gewinnt der früheste Treffer, bei gleicher Position der
+    # Ausdruck mit den vorderen Alternativen.
+    
+    def __init__(self, regexes):
+        
+        self._regexes = regexes
+        
+    def getRegexes(self):
+        
+        return self._regexes
+        
+    def match(self, text, pos=0):
+        
+        for regex in self._regexes:
+            match = regex.match(text, pos)
+            if match:
+                return match
+            
+        return None
+    
+    def search(self, text, pos=0):
+        
+        res = None
+        for regex in self._regexes:
+            match = regex.search(text, pos)
+            if match and (res is None or match.start() < res.start()):
+                res = match
+                
+        return res
+    
+    def finditer(self, text, pos=0):
+        
+        # Nächster Treffer je Ausdruck, erneut gesucht erst, wenn er hinter
+        # der Position zurückliegt:
+        regexes = self._regexes
+        matches = [regex.search(text, pos) for regex in regexes]
+        
+        while True:
+            
+            res = None
+            for idx, match in enumerate(matches):
+                if match and match.start() < pos:
+                    match = matches[idx] = regexes[idx].search(text, pos)
+                if match and (res is None or match.start() < res.start()):
+                    res = match
+                    
+            if res is None:
+                return
+            
+            yield res
+            
+            pos = max(res.end(), res.start() + 1)
+
+def _exportRegex(regex):
+    
+    if isinstance(regex, _AlternativesRegex):
+        return [exportRegex(part) for part in regex.getRegexes()]
+    else:
+        return exportRegex(regex)
+    
+def _importRegex(data):
+    
+    if isinstance(data, list):
+        return _AlternativesRegex([importRegex(part) for part in data])
+    else:
+        return importRegex(data)
+
+# ===== Prozesse von Lexer.tokenizeParallel: =====
 
-class LexerMode:
+_workerLexer = None
+
+def _initWorker(lexer):
+    
+    global _workerLexer
+    _workerLexer = lexer
+    
+def _tokenizeChunk(text):
     
-    NORMAL = 1
-    LINE_COMMENT = 2
-    BLOCK_COMMENT = 3
+    return _workerLexer._tokenizeChunk(text)
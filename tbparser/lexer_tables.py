@@ -0,0 +1,96 @@
+# coding=UTF-8
+
+# This file is part of TBParser.
+#
+# TBParser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TBParser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TBParser.  If not, see <http://www.gnu.org/licenses/>.
+
+# Fertig zusammengesetzte reguläre Ausdrücke des Lexers: Abgelegt werden
+# nur Muster und Flags, übersetzt wird beim Laden mit re.compile. Gespart
+# wird das Zusammensetzen (Aufteilen zu großer Alternationen, Prüfen der
+# Muster). Da die Datei in einem beschreibbaren Verzeichnis liegt, wird
+# nichts davon ungeprüft an _sre übergeben.
+
+import hashlib
+import marshal
+import os
+import re
+import sys
+
+# Aufbau der Ausdrücke (Gruppennamen, Alternativen): Bei jeder Änderung
+# erhöhen, sonst lädt eine neue Version alte, unpassende Tabellen.
+FORMAT_VERSION = 4
+
+def exportRegex(regex):
+
+    if not regex:
+        return None
+
+    return regex.pattern, regex.flags
+
+def importRegex(data):
+
+    if not data:
+        return None
+
+    pattern, flags = data
+    if not isinstance(pattern, basestring) or not isinstance(flags, int):
+        raise ValueError('Invalid table entry')
+
+    return re.compile(pattern, flags)
+
+def createKey(description):
+
+    # description: Liste der für die Ausdrücke relevanten Einstellungen
+    data = repr((FORMAT_VERSION, sys.version_info[:3], description))
+
+    return hashlib.sha1(data).hexdigest()
+
+class LexerTableCache(object):
+
+    SUFFIX = '.lxt'
+
+    def __init__(self, cacheDir):
+
+        self._cacheDir = cacheDir
+
+    def getFilePath(self, key):
+
+        return os.path.join(self._cacheDir, key + LexerTableCache.SUFFIX)
+
+    def load(self, key):
+
+        try:
+            with open(self.getFilePath(key), 'rb') as cacheFile:
+                return marshal.load(cacheFile)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def save(self, key, tables):
+
+        if not os.path.isdir(self._cacheDir):
+            os.makedirs(self._cacheDir)
+
+        # Erst vollständig schreiben, dann umbenennen (parallele Prozesse
+        # sehen nie eine halbe Datei):
+        filePath = self.getFilePath(key)
+        tmpPath = "%s.%d" % (filePath, os.getpid())
+
+        try:
+            with open(tmpPath, 'wb') as cacheFile:
+                marshal.dump(tables, cacheFile)
+            os.rename(tmpPath, filePath)
+        except:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
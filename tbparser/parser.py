@@ -15,22 +15,30 @@
 # You should have received a copy of the GNU General Public License
 # along with TBParser.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
+
 from tbparser.lexer import Lexer
-from tbparser.instream import FileInput, StringInput
+from tbparser.instream import FileInput, MmapFileInput, StringInput
 from tbparser.token import Keyword
 from tbparser.grammar import SuccessorError
 
 class Parser(object):
+    
+    MEMO_SIZE = 50000 # <- Einträge im Memo der Suche (s. enableMemo)
 
     def __init__(self, grammar):
 
         self._grammar = grammar
+        self._typeTable = grammar.getTokenTypeTable()
         
-        self._lexer = Lexer()
+        self._lexer = Lexer(self._typeTable)
         for tt in self._grammar.getTokenTypes():
             self._lexer.addTokenType(tt)
             
         self._curFile = None
+        self._memoSize = 0
+        self._memo = None
+        self._compiled = False
         
     def enableLineComments(self, lineCommentStart='//'):
         
@@ -43,11 +51,99 @@ class Parser(object):
                             ):
 
         self._lexer.enableBlockComments(blockCommentStart, blockCommentEnd)
+        
+    def setLexerEngine(self, engine):
+        
+        self._lexer.setEngine(engine)
+        
+    # s. Lexer.setBytesMode
+    def setBytesMode(self, encoding='ascii'):
+        
+        self._lexer.setBytesMode(encoding)
+        
+    # s. Lexer.setWhiteSpace
+    def setWhiteSpace(self, charCodes):
+        
+        self._lexer.setWhiteSpace(charCodes)
+        
+    # s. lexer.TokenTextMode
+    def setTokenTextMode(self, mode):
+        
+        self._lexer.setTokenTextMode(mode)
+        
+    # s. Lexer.useTableCache
+    def useLexerTableCache(self, cacheDir):
+        
+        return self._lexer.useTableCache(cacheDir)
+
+    # Packrat-Memo für die Suche nach dem nächsten passenden Knoten: Je
+    # (Knoten, Token, Umgebung) wird das Ergebnis der Teilsuche gemerkt, so
+    # dass sie beim Backtracking nicht erneut durchlaufen wird. Beim
+    # Backtracking verworfene Knoten werden als Sackgasse vermerkt. Das Memo
+    # gilt für einen Parse-Lauf und hält höchstens maxEntries Einträge
+    # (die am längsten nicht benutzten werden verdrängt).
+    def enableMemo(self, maxEntries=MEMO_SIZE):
+        
+        self._memoSize = maxEntries
+        
+    def disableMemo(self):
+        
+        self._memoSize = 0
+
+    # Vorhersagetabellen (LL(1), bei Mehrdeutigkeit LL(2)) für die stabilen
+    # Teile des Grammatikgraphen: Wurzel und Expansionen kontextunabhängiger
+    # Regeln (s. Rule.setContextIndependent). Je Knoten und Typen des
+    # aktuellen (und ggf. nächsten) Tokens wird der Weg zum passenden
+    # Tokenknoten einmal bestimmt und danach direkt übernommen. An Switch-
+    # und Condition-Knoten sowie kontextabhängigen Regeln wird weiterhin
+    # gesucht. Die von der Wurzel aus erreichbaren stabilen Knoten erhalten
+    # ihre Tabellen hier für jeden einzelnen Tokentyp. Einträge für Tokens
+    # mit mehreren Typen und für erst beim Parsen entstehende Regelinstanzen
+    # kommen beim Parsen hinzu.
+    def compile(self):
+        
+        root = self._grammar.getSocket()
+        root.setStable()
+        self._grammar.getEndNode().setStable()
+        self._compiled = True
+        
+        context = Context(Path())
+        visited = set()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node in visited or not node.isStable():
+                continue
+            visited.add(node)
+            self._fillPredictionTable(context, node)
+            stack.extend(node.getLinkedNodes())
 
     def parse(self, inStream):
         
-        self._lexer.setInputStream(inStream)
+        return self._parseTokens(self._lexer.tokenize(inStream))
+    
+    # Parsen der mit tokenizeTable erzeugten Tokentabelle. Der Parser
+    # arbeitet dabei mit Verweisen in die Tabelle (s. TokenRef), Texte
+    # werden nur für die Blätter des AST und Fehlermeldungen ausgeschnitten:
+    def parseTable(self, tokenTable):
+        
+        return self._parseTokens(tokenTable.iterRefs())
+    
+    def tokenizeTable(self, inStream):
+        
+        return self._lexer.tokenizeTable(inStream)
+    
+    def _parseTokens(self, tokens):
+        
+        self._tokens = tokens
         self._tokenBuffer = []
+        self._lookahead = [] # <- Vorausgelesenes Token (s. _peekNextToken)
+        self._memo = self._memoSize and _SearchMemo(self._memoSize) or None
+        self._lastToken = None # <- Zuletzt gelesenes Token
+        # Art des letzten Fehlschlags (am Ende der Eingabe oder an einem
+        # Token), danach richtet sich die Fehlermeldung:
+        self._lastFailureAtEnd = False
+        self._skips = 0 # <- Vom Memo übersprungene Sackgassen
         path = Path()
         path.push(self._grammar.getSocket(), None)
         error = False
@@ -64,6 +160,7 @@ class Parser(object):
                 if found:
                     done = True    
                 else:
+                    self._lastFailureAtEnd = True
                     found, path = self._findNextSibling(path)
                     if not found:
                         error = True
@@ -71,34 +168,50 @@ class Parser(object):
 
                 continue
  
+            skips = self._skips
             found, path = self._findNextMatchingNode(token, path)
             
             if found:
                 self._tokenBuffer.pop()
             else:
+                if self._skips == skips:
+                    self._lastFailureAtEnd = False
                 found, path = self._findNextSibling(path)
                 if not found:
                     done = True
                     error = True
         
+        self._memo = None
+        
         if not error:
             return self._createAst(path)
+        elif not self._lastFailureAtEnd:
+            # Fehlschlag am am weitesten gelesenen Token:
+            token = self._lastToken
+            text = token.getText()
+            line, column = token.getStartPosition()
+            raise ParseError(self._curFile, line, column, text)
         else:
-            if self._tokenBuffer:
-                token = self._tokenBuffer[0] 
-                text = token.getText()
-                line, column = token.getStartPosition()
-                raise ParseError(self._curFile, line, column, text)
-            else:
-                raise Exception("Parsing error")
+            raise Exception("Parsing error")
 
-    def parseFile(self, filePath):
+    def parseFile(self, filePath, encoding=None, mmap=False):
         
         self._curFile = filePath
-
-        res = self.parse(FileInput(filePath))
         
-        self._curFile = None
+        # Im Bytes-Modus dekodiert erst der Lexer (s. Lexer.setBytesMode):
+        if self._lexer.getBytesEncoding():
+            encoding = None
+            
+        if mmap:
+            inStream = MmapFileInput(filePath, encoding)
+        else:
+            inStream = FileInput(filePath, encoding)
+
+        try:
+            res = self.parse(inStream)
+        finally:
+            inStream.close()
+            self._curFile = None
 
         return res
     
@@ -181,6 +294,7 @@ class Parser(object):
                 removed.append(elem)
                 if token:
                     self._tokenBuffer.append(token)
+                self._markDeadEnd(elem.getGrammarNode(), path)
  
     def _gotoNextSibling(self, path):
             
@@ -206,6 +320,7 @@ class Parser(object):
                 sibling = successors[idx+1]
                 if token:
                     self._tokenBuffer.append(token)
+                self._markDeadEnd(start, path)
                 path.push(sibling, None)
                 return True, path
             else:
@@ -218,15 +333,33 @@ class Parser(object):
     def _getNextToken(self):
         
         if not self._tokenBuffer:
-            token = self._lexer.getNextToken();
+            if self._lookahead:
+                token = self._lookahead.pop()
+            else:
+                token = next(self._tokens, None)
             if token:
                 self._tokenBuffer.append(token)
+                self._lastToken = token
 
         if self._tokenBuffer:
             return self._tokenBuffer[-1]
         else:
             return None
 
+    # Token nach dem aktuellen (None am Ende der Eingabe):
+    def _peekNextToken(self):
+        
+        if len(self._tokenBuffer) > 1:
+            return self._tokenBuffer[-2]
+        
+        if not self._lookahead:
+            token = next(self._tokens, None)
+            if not token:
+                return None
+            self._lookahead.append(token)
+            
+        return self._lookahead[0]
+
     def _findNextMatchingNode(self, token, path):
         
         elem = path.getElement(-1)
@@ -235,17 +368,33 @@ class Parser(object):
         
         if startNode.isTokenNode() and startToken is None:
             
-            if startNode.getTokenTypeId() in token.getTypeIds():
+            if token.hasType(startNode.getTokenType()):
                 path.pop()
                 path.push(startNode, token)
                 return True, path
             else:
                 return False, path
+            
+        if self._compiled and startNode.isStable():
+            segment = self._predict(token, path, startNode)
+            if segment is not None:
+                if not segment:
+                    return False, path
+                for node in segment[:-1]:
+                    path.push(node, None)
+                path.push(segment[-1], token)
+                return True, path
 
         try:
             successors = startNode.getSuccessors(Context(path, token))
         except SuccessorError:
             return False, path
+        
+        if self._memo is not None:
+            return self._searchMemoized(token, path, successors)
+        
+        successors = [succ for succ in successors 
+                      if not self._excludes(succ, token)]
 
         for succ in successors:
             
@@ -259,6 +408,232 @@ class Parser(object):
     
         return False, path
     
+    # Suche mit Memo: Das Ergebnis der Teilsuche ab einem Nachfolger wird je
+    # (Knoten, Token, Umgebung) gemerkt. Nachfolger, die beim Backtracking
+    # schon als Sackgasse verworfen wurden (s. _markDeadEnd), werden
+    # übersprungen. Damit Fehler trotzdem wie ohne Memo gemeldet werden, wird
+    # _lastFailureAtEnd so nachgeführt, wie es die Suche ohne Memo beim
+    # Durchlaufen der Sackgassen getan hätte.
+    def _searchMemoized(self, token, path, successors):
+        
+        memo = self._memo
+        envState = path.getEnvState()
+        try:
+            hash(envState)
+        except TypeError: # <- Umgebung mit nicht hashbaren Werten
+            memo = None
+        # Ohne Memo würden die weiteren Nachfolger erst nach einer Sackgasse
+        # per Backtracking erreicht, ihr Scheitern wäre also ein Fehlschlag:
+        skipped = False
+        
+        for succ in successors:
+            
+            length = path.getLength()
+            
+            if self._excludes(succ, token):
+                segment, failureAtEnd = (), None
+            else:
+                key = (_MATCH, succ, token, envState)
+                entry = memo is not None and memo.lookup(key) or None
+                if entry is not None:
+                    # Ergebnis einer früheren Teilsuche übernehmen:
+                    segment, failureAtEnd = entry
+                    if failureAtEnd is not None:
+                        self._lastFailureAtEnd = failureAtEnd
+                        self._skips += 1
+                    for node, segmentToken in segment:
+                        path.push(node, segmentToken)
+                else:
+                    skips = self._skips
+                    path.push(succ, None)
+                    found, path = self._findNextMatchingNode(token, path)
+                    if found:
+                        segment = path.getSegment(length)
+                    else:
+                        path.pop()
+                        segment = ()
+                    failureAtEnd = None
+                    if self._skips != skips:
+                        failureAtEnd = self._lastFailureAtEnd
+                    if memo is not None:
+                        memo.store(key, (segment, failureAtEnd))
+            
+            if not segment:
+                if failureAtEnd is not None:
+                    skipped = True
+                elif skipped:
+                    self._lastFailureAtEnd = False
+                continue
+            
+            deadEnd = None
+            if memo is not None:
+                deadEnd = memo.lookup((_DEAD_END, succ, token, envState))
+            if deadEnd is None:
+                return True, path
+            
+            while path.getLength() > length:
+                path.pop()
+            self._lastFailureAtEnd = deadEnd
+            self._skips += 1
+            skipped = True
+    
+        return False, path
+    
+    # Weg laut Vorhersagetabelle des (stabilen) Knotens: Knotenfolge bis
+    # einschließlich des passenden Tokenknotens, () wenn es keinen gibt, None
+    # wenn nur die Suche entscheiden kann.
+    def _predict(self, token, path, node):
+        
+        table = node.getPredictionTable()
+        mask = token.getTypeMask()
+        
+        try:
+            entry = table[mask]
+        except KeyError:
+            entry = self._createPrediction(Context(path, token), node, mask)
+            table[mask] = entry
+        
+        if not isinstance(entry, dict):
+            return entry
+        
+        nextToken = self._peekNextToken()
+        nextMask = nextToken and nextToken.getTypeMask() or None
+        try:
+            return entry[nextMask]
+        except KeyError:
+            res = self._createLL2Prediction(Context(path, token), node, mask,
+                                            nextMask)
+            entry[nextMask] = res
+            return res
+        
+    # Einträge für alle einzelnen Tokentypen (und bei LL(2) alle Typen des
+    # nächsten Tokens), s. compile:
+    def _fillPredictionTable(self, context, node):
+        
+        table = node.getPredictionTable()
+        masks = [self._typeTable.getMask(tokenType) 
+                 for tokenType in self._grammar.getTokenTypes()]
+        
+        for mask in masks:
+            if mask not in table:
+                table[mask] = self._createPrediction(context, node, mask)
+            entry = table[mask]
+            if isinstance(entry, dict):
+                for nextMask in masks + [None]:
+                    if nextMask not in entry:
+                        entry[nextMask] = self._createLL2Prediction(
+                            context, node, mask, nextMask)
+        
+    def _createPrediction(self, context, node, mask):
+        
+        paths = self._findStaticPaths(context, node, mask, None, set())
+        try:
+            first = next(paths, ())
+        except _DynamicNode:
+            return None
+        
+        if not first:
+            return ()
+        
+        try:
+            second = next(paths, None)
+        except _DynamicNode:
+            second = True
+        
+        if second:
+            return {}
+        else:
+            return first # <- LL(1)
+        
+    # Mehrere Wege (LL(2)): nächstes Token entscheidet. Passt keiner, den
+    # ersten nehmen, damit der Fehler wie bei der Suche erst beim nächsten
+    # Token gemeldet wird.
+    def _createLL2Prediction(self, context, node, mask, nextMask):
+        
+        paths = self._findStaticPaths(context, node, mask, nextMask, set())
+        try:
+            res = next(paths, ())
+        except _DynamicNode:
+            res = None
+        if res == ():
+            paths = self._findStaticPaths(context, node, mask, None, set())
+            res = next(paths)
+            
+        return res
+        
+    # Wege zu Tokenknoten eines der Typen in mask (in Suchreihenfolge). Ist
+    # nextMask gegeben, nur solche, nach denen ein Token dieser Typen folgen
+    # kann. Löst _DynamicNode aus, sobald ein Knoten erreicht wird, dessen
+    # Nachfolger nur dynamisch bestimmbar sind.
+    def _findStaticPaths(self, context, node, mask, nextMask, onPath):
+        
+        typeTable = self._typeTable
+        
+        if node.isRuleStart():
+            if not node.isContextIndependent():
+                raise _DynamicNode
+            successors = node.getSuccessors(context)
+        else:
+            successors = node.getStaticSuccessors()
+            if successors is None:
+                raise _DynamicNode
+        
+        for succ in successors:
+            
+            if not mask & succ.getFirstMask(typeTable):
+                continue
+            
+            if succ.isTokenNode():
+                if succ.changesEnv():
+                    raise _DynamicNode
+                if nextMask is None or nextMask & self._getFollowMask(succ):
+                    yield (succ,)
+            elif succ in onPath:
+                raise _DynamicNode # <- Zyklus ohne Token
+            else:
+                onPath.add(succ)
+                for rest in self._findStaticPaths(context, succ, mask, 
+                                                  nextMask, onPath):
+                    yield (succ,) + rest
+                onPath.discard(succ)
+                
+    def _getFollowMask(self, tokenNode):
+        
+        res = 0
+        for succ in tokenNode.getStaticSuccessors():
+            res |= succ.getFirstMask(self._typeTable)
+            
+        return res
+    
+    # Nachfolger, von dem aus das Token sicher nicht erreichbar ist (wird
+    # dann gar nicht erst in den Pfad aufgenommen): Tokenknoten werden direkt
+    # geprüft, Regeln über ihre FIRST-Menge. Die übrigen technischen Knoten
+    # sind meist frisch expandiert, dort lohnt die Analyse nicht.
+    def _excludes(self, succ, token):
+        
+        if succ.isTokenNode():
+            return not token.hasType(succ.getTokenType())
+        elif succ.isRuleStart():
+            return not token.getTypeMask() & \
+                succ.getFirstMask(self._typeTable)
+        else:
+            return False
+    
+    # Beim Backtracking verworfenes Element: Alle Fortsetzungen ab seinem
+    # Knoten sind mit dem nächsten Token gescheitert. Gemerkt wird auch, ob
+    # der letzte Fehlschlag dabei am Ende der Eingabe lag.
+    def _markDeadEnd(self, node, path):
+        
+        if self._memo is None:
+            return
+        
+        nextToken = self._tokenBuffer and self._tokenBuffer[-1] or None
+        try:
+            self._memo.store((_DEAD_END, node, nextToken, path.getEnvState()),
+                             self._lastFailureAtEnd)
+        except TypeError:
+            pass
+    
     def _findPathToEnd(self, path):
 
         node = path.getElement(-1).getGrammarNode()
@@ -285,6 +660,43 @@ class Parser(object):
     
         return False, path
 
+class _DynamicNode(Exception):
+    
+    pass
+
+# Schlüsselarten im Memo der Suche:
+_MATCH = 'match' # <- Teilsuche ab einem Knoten
+_DEAD_END = 'deadEnd' # <- Beim Backtracking verworfener Knoten
+
+class _SearchMemo(object):
+    
+    # Ergebnisse von Teilsuchen als (Segment, Art des letzten Fehlschlags):
+    # Das Segment ist ein leeres Tupel bei Misserfolg, sonst die dabei
+    # angehängten Pfadelemente als (Knoten, Token). Die Art des Fehlschlags
+    # ist None, wenn keine Sackgasse übersprungen wurde. Zu Sackgassen wird
+    # nur die Art ihres letzten Fehlschlags gemerkt.
+    
+    def __init__(self, maxEntries):
+        
+        self._maxEntries = maxEntries
+        self._entries = OrderedDict()
+        
+    def lookup(self, key):
+        
+        entries = self._entries
+        res = entries.pop(key, None)
+        if res is not None:
+            entries[key] = res # <- zuletzt benutzt
+        
+        return res
+    
+    def store(self, key, value):
+        
+        entries = self._entries
+        entries[key] = value
+        if len(entries) > self._maxEntries:
+            entries.popitem(last=False)
+
 class PathElement(object):
 
     def __init__(self, grammarNode, token):
@@ -309,16 +721,17 @@ class Path(object):
     def __init__(self):
 
         self._elements = []
-        self._envStack = [] # Stack der Umgebungen
+        self._scopes = [] # Stack der sichtbaren Umgebungen
+        self._closedScopes = [] # Am Regelende verlassene Umgebungen
 
     def push(self, grammarNode, token):
         
         self._elements.append(PathElement(grammarNode, token))
         
         if grammarNode.isRuleStart():
-            self._envStack.append(grammarNode.getEnvVars())
+            self._scopes.append(grammarNode.getEnvVars())
         elif grammarNode.isRuleEnd():
-            self._envStack.append(False)
+            self._closedScopes.append(self._scopes.pop())
         elif grammarNode.isTokenNode() and grammarNode.changesEnv():
             envVars = self._getCurEnvVars()
             if envVars is not None:
@@ -329,8 +742,10 @@ class Path(object):
         res = self._elements.pop()
         
         node = res.getGrammarNode()
-        if node.isRuleStart() or node.isRuleEnd():
-            self._envStack.pop()
+        if node.isRuleStart():
+            self._scopes.pop()
+        elif node.isRuleEnd():
+            self._scopes.append(self._closedScopes.pop())
         elif node.isTokenNode() and node.changesEnv():
             envVars = self._getCurEnvVars()
             if envVars is not None:
@@ -359,40 +774,33 @@ class Path(object):
             raise Exception('Invalid path element index')
         
         return self._elements[index]
+    
+    # Ab Index start angehängte Elemente als (Knoten, Token):
+    def getSegment(self, start):
         
-    def getEnvVar(self, name):
+        return tuple([(elem.getGrammarNode(), elem.getToken())
+                      for elem in self._elements[start:]])
         
-        envVarStack = []
+    def getEnvVar(self, name):
         
-        for env in self._envStack:
-            if not isinstance(env, bool):
-                envVarStack.append(env)
-            else:
-                envVarStack.pop()
-
-        idx = len(envVarStack) - 1
-        while (idx > -1):
-            if name in envVarStack[idx]:
-                return envVarStack[idx][name]
-            idx -= 1
+        for envVars in reversed(self._scopes):
+            if name in envVars:
+                return envVars[name]
             
         return None
+    
+    # Inhalt der sichtbaren Umgebungen (hashbar, sofern es die Werte sind):
+    def getEnvState(self):
+        
+        return tuple([tuple(sorted(envVars.items())) 
+                      for envVars in self._scopes])
  
     def _getCurEnvVars(self):
         
-        idx = len(self._envStack) - 1
-        level = 0
-        while (idx >= 0):
-            envVars = self._envStack[idx]
-            if not isinstance(envVars, bool):
-                if level == 0:
-                    return envVars
-                level += 1
-            else:
-                level -= 1
-            idx -= 1
-        
-        return None
+        if self._scopes:
+            return self._scopes[-1]
+        else:
+            return None
 
     def __repr__(self):
 
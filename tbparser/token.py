@@ -16,15 +16,27 @@
 # along with TBParser.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
+from array import array
 
 class Token(object):
     
-    def __init__(self, text, types):
+    __slots__ = ('_text', '_typeMask', '_typeTable', '_offset', '_lineIndex', 
+                 '_position')
+    
+    # Ohne typeTable ist types eine Liste von Tokentypen, sonst eine Bitmaske
+    # über die Nummern der Tabelle:
+    def __init__(self, text, types, typeTable=None, offset=-1, lineIndex=None):
+        
+        if typeTable is None:
+            typeTable = TokenTypeTable(types)
+            types = (1 << typeTable.getSize()) - 1
         
         self._text = text
-        self._types = types
-        self._line = 0
-        self._column = 0
+        self._typeMask = types
+        self._typeTable = typeTable
+        self._offset = offset
+        self._lineIndex = lineIndex
+        self._position = (0, 0)
         
     def getText(self):
         
@@ -32,20 +44,353 @@ class Token(object):
     
     def getTypeIds(self):
         
-        return [type_.getId() for type_ in self._types]
+        return [type_.getId() for type_ in self.getTypes()]
         
     def getTypes(self):
         
-        return self._types
+        return self._typeTable.getTypes(self._typeMask)
+    
+    def getTypeMask(self):
+        
+        return self._typeMask
+    
+    def getTypeTable(self):
+        
+        return self._typeTable
+    
+    def hasType(self, tokenType):
+        
+        return bool(self._typeMask & self._typeTable.getMask(tokenType))
     
     def setStartPosition(self, line, column):
         
-        self._line = line
-        self._column = column
+        self._position = (line, column)
+        self._lineIndex = None
+        
+    # Zeile/Spalte werden dann erst in getStartPosition über den
+    # Zeilenindex bestimmt:
+    def setStartOffset(self, offset, lineIndex):
+        
+        self._offset = offset
+        self._lineIndex = lineIndex
+        
+    def getStartOffset(self):
+        
+        return self._offset
         
     def getStartPosition(self):
         
-        return self._line, self._column
+        if self._lineIndex is not None:
+            return self._lineIndex.getPosition(self._offset)
+        
+        return self._position
+    
+    def copy(self):
+        
+        res = Token(self._text, 
+                    self._typeMask, 
+                    self._typeTable, 
+                    self._offset, 
+                    self._lineIndex)
+        res._position = self._position
+        
+        return res
+    
+class SourceToken(Token):
+    
+    # Token ohne eigene Kopie des Texts: verweist über Offset und Länge in
+    # den Quelltext, der Text wird erst in getText ausgeschnitten.
+    
+    __slots__ = ('_source', '_length')
+    
+    def __init__(self, source, length, types, typeTable=None, offset=-1, 
+                 lineIndex=None):
+        
+        Token.__init__(self, None, types, typeTable, offset, lineIndex)
+        
+        self._source = source
+        self._length = length
+        
+    def getText(self):
+        
+        return self._source[self._offset:self._offset + self._length]
+    
+    def setSource(self, source):
+        
+        self._source = source
+        
+    def copy(self):
+        
+        res = SourceToken(self._source, 
+                          self._length, 
+                          self._typeMask, 
+                          self._typeTable, 
+                          self._offset, 
+                          self._lineIndex)
+        res._position = self._position
+        
+        return res
+    
+class BytesToken(Token):
+    
+    # Token mit undekodiertem Text (Bytes-Modus des Lexers). Dekodiert wird
+    # erst in getText.
+    
+    __slots__ = ('_encoding',)
+    
+    def __init__(self, data, encoding, types, typeTable=None, offset=-1, 
+                 lineIndex=None):
+        
+        Token.__init__(self, data, types, typeTable, offset, lineIndex)
+        
+        self._encoding = encoding
+        
+    def getText(self):
+        
+        if isinstance(self._text, unicode):
+            return self._text
+        
+        return self._text.decode(self._encoding)
+    
+    def getBytes(self):
+        
+        return self._text
+    
+    def copy(self):
+        
+        res = BytesToken(self._text, 
+                         self._encoding, 
+                         self._typeMask, 
+                         self._typeTable, 
+                         self._offset, 
+                         self._lineIndex)
+        res._position = self._position
+        
+        return res
+    
+class TokenTypeTable(object):
+    
+    # Dichte Nummerierung 0..N-1 der Tokentypen, z.B. eines Lexers. Mengen
+    # von Tokentypen werden als Bitmasken über diese Nummern dargestellt.
+    
+    def __init__(self, tokenTypes=()):
+        
+        self._types = []
+        self._masks = {}
+        
+        for tt in tokenTypes:
+            self.add(tt)
+            
+    def add(self, tokenType):
+        
+        if tokenType not in self._masks:
+            self._masks[tokenType] = 1 << len(self._types)
+            self._types.append(tokenType)
+        
+        return self.getIndex(tokenType)
+    
+    def getIndex(self, tokenType):
+        
+        mask = self._masks.get(tokenType, 0)
+        
+        return mask.bit_length() - 1
+    
+    def getMask(self, tokenType):
+        
+        return self._masks.get(tokenType, 0)
+    
+    def getType(self, index):
+        
+        return self._types[index]
+    
+    def getTypes(self, mask):
+        
+        res = []
+        idx = 0
+        while mask:
+            if mask & 1:
+                res.append(self._types[idx])
+            mask >>= 1
+            idx += 1
+            
+        return res
+    
+    def getSize(self):
+        
+        return len(self._types)
+        
+class TokenTable(object):
+    
+    # Spaltenweise Ablage der Tokens eines Quelltexts in parallelen
+    # array-Puffern. Statt der Typmaske selbst wird deren Nummer abgelegt
+    # (Masken können mehr als 32 Bit umfassen). Den Text schneidet getText
+    # erst bei Bedarf aus dem Quelltext. Positionen als 'l' wie in LineIndex
+    # (Quelltexte über 2 GiB).
+    
+    def __init__(self, source, typeTable, literalMask=0, unescape=None):
+        
+        self._source = source
+        self._typeTable = typeTable
+        self._literalMask = literalMask
+        self._unescape = unescape
+        
+        self._maskNums = array('i')
+        self._offsets = array('l')
+        self._lengths = array('l')
+        self._lines = array('l')
+        self._columns = array('l')
+        
+        self._masks = [] # <- Nummer -> Typmaske
+        self._numbers = {} # <- Typmaske -> Nummer
+        
+    def __len__(self):
+        
+        return len(self._offsets)
+    
+    def __iter__(self):
+        
+        for idx in xrange(len(self._offsets)):
+            yield self.getToken(idx)
+            
+    # Leichte Verweise statt vollständiger Tokens (s. TokenRef):
+    def iterRefs(self):
+        
+        for idx in xrange(len(self._offsets)):
+            yield TokenRef(self, idx)
+            
+    def append(self, mask, offset, length):
+        
+        num = self._numbers.get(mask)
+        if num is None:
+            num = self._numbers[mask] = len(self._masks)
+            self._masks.append(mask)
+            
+        self._maskNums.append(num)
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        
+    # Zeile und Spalte aller Tokens in einem Durchgang bestimmen (die
+    # Offsets sind aufsteigend sortiert):
+    def setPositions(self, lineIndex):
+        
+        lineStarts = lineIndex.getLineStarts()
+        numLines = len(lineStarts)
+        line = 1
+        
+        lines = array('l')
+        columns = array('l')
+        
+        for offset in self._offsets:
+            while line < numLines and lineStarts[line] <= offset:
+                line += 1
+            lines.append(line)
+            columns.append(offset - lineStarts[line - 1] + 1)
+        
+        self._lines = lines
+        self._columns = columns
+        
+    def getSource(self):
+        
+        return self._source
+        
+    def getTypeTable(self):
+        
+        return self._typeTable
+        
+    def getTypeMask(self, idx):
+        
+        return self._masks[self._maskNums[idx]]
+    
+    def getTypes(self, idx):
+        
+        return self._typeTable.getTypes(self.getTypeMask(idx))
+    
+    def hasType(self, idx, tokenType):
+        
+        return bool(self.getTypeMask(idx) & self._typeTable.getMask(tokenType))
+    
+    def getOffset(self, idx):
+        
+        return self._offsets[idx]
+    
+    def getLength(self, idx):
+        
+        return self._lengths[idx]
+    
+    def getPosition(self, idx):
+        
+        return self._lines[idx], self._columns[idx]
+    
+    def getText(self, idx):
+        
+        start = self._offsets[idx]
+        text = self._source[start:start + self._lengths[idx]]
+        
+        if self._unescape and self.getTypeMask(idx) == self._literalMask:
+            text = self._unescape(text)
+            
+        return text
+    
+    def getToken(self, idx):
+        
+        res = Token(self.getText(idx), 
+                    self.getTypeMask(idx), 
+                    self._typeTable, 
+                    self._offsets[idx])
+        res.setStartPosition(self._lines[idx], self._columns[idx])
+        
+        return res
+    
+class TokenRef(object):
+    
+    # Verweis auf ein Token einer TokenTable mit der Schnittstelle von
+    # Token: Die Typmaske wird beim Anlegen aus den Spalten gelesen, der
+    # Text erst in getText ausgeschnitten.
+    
+    __slots__ = ('_table', '_index', '_typeMask', '_typeTable')
+    
+    def __init__(self, table, index):
+        
+        self._table = table
+        self._index = index
+        self._typeMask = table.getTypeMask(index)
+        self._typeTable = table.getTypeTable()
+        
+    def getIndex(self):
+        
+        return self._index
+        
+    def getText(self):
+        
+        return self._table.getText(self._index)
+    
+    def getTypes(self):
+        
+        return self._table.getTypes(self._index)
+    
+    def getTypeMask(self):
+        
+        return self._typeMask
+    
+    def getTypeTable(self):
+        
+        return self._typeTable
+    
+    def hasType(self, tokenType):
+        
+        return bool(self._typeMask & self._typeTable.getMask(tokenType))
+    
+    def getStartOffset(self):
+        
+        return self._table.getOffset(self._index)
+        
+    def getStartPosition(self):
+        
+        return self._table.getPosition(self._index)
+    
+    def getToken(self):
+        
+        return self._table.getToken(self._index)
         
 class TokenType(object):
     
@@ -59,11 +404,20 @@ class TokenType(object):
         TokenType.currentId += 1
         self._id = TokenType.currentId
         self._len = 0
+        self._pattern = None
+        self._regexStr = None
+        self._regex = None
         
     def getId(self):
         
         return self._id
     
+    # Regulärer Ausdruck für das Token ohne Anker (None, falls keiner
+    # existiert):
+    def getPattern(self):
+        
+        return self._pattern
+    
     def createToken(self, text):
         
         raise NotImplementedError
@@ -78,6 +432,15 @@ class TokenType(object):
         else:
             return 0
 
+    # Der eigene Ausdruck wird erst bei Bedarf übersetzt (der Lexer arbeitet
+    # mit gemeinsamen Ausdrücken über alle Tokentypen):
+    def _getRegex(self):
+        
+        if self._regex is None:
+            self._regex = re.compile(self._regexStr)
+            
+        return self._regex
+
     def _escape(self, text):
         
         for ch in ['+', '*', '.']:
@@ -91,12 +454,13 @@ class Word(TokenType):
         
         TokenType.__init__(self)
         
-        self._regex = re.compile(r"\A(%s)\Z" % pattern)
+        self._regexStr = r"\A(%s)\Z" % pattern
         self._len = len(pattern)
+        self._pattern = pattern
         
     def createToken(self, text):
         
-        match = self._regex.match(text)
+        match = self._getRegex().match(text)
         if match:
             return Token(match.group(1), [self])
         else:
@@ -104,7 +468,7 @@ class Word(TokenType):
         
     def matches(self, text):
         
-        return bool(self._regex.match(text))
+        return bool(self._getRegex().match(text))
         
 class Keyword(TokenType):
     
@@ -179,12 +543,13 @@ class Prefix(TokenType):
             tmp = tokenText
         
         regexStr = r"\A(%s)(\S+)\Z" % tmp 
-        self._regex = re.compile(regexStr)
+        self._regexStr = regexStr
         self._len = len(tokenText)
+        self._pattern = tmp
     
     def createToken(self, text):
         
-        match = self._regex.match(text)
+        match = self._getRegex().match(text)
 
         if match:
             return Token(match.group(1), [self])
@@ -193,7 +558,7 @@ class Prefix(TokenType):
             
     def getRemainingRight(self, text):
 
-        match = self._regex.match(text)
+        match = self._getRegex().match(text)
 
         if match:
             return match.group(2) or ""
@@ -212,12 +577,13 @@ class Postfix(TokenType):
             tmp = tokenText
         
         regexStr = r"\A(\S+)(%s)\Z" % tmp
-        self._regex = re.compile(regexStr)
+        self._regexStr = regexStr
         self._len = len(tokenText)
+        self._pattern = tmp
     
     def createToken(self, text):
         
-        match = self._regex.match(text)
+        match = self._getRegex().match(text)
 
         if match:
             return Token(match.group(2), [self])
@@ -226,7 +592,7 @@ class Postfix(TokenType):
             
     def getRemainingLeft(self, text):
 
-        match = self._regex.match(text)
+        match = self._getRegex().match(text)
 
         if match:
             return match.group(1) or ""
@@ -239,8 +605,9 @@ class Separator(TokenType):
     def create(pattern):
         
         res = Separator('')
-        res._regex = re.compile(pattern)
+        res._regexStr = pattern
         res._len = len(pattern)
+        res._pattern = None # <- Trenner nicht separat verfügbar
         
         return res
                    
@@ -255,14 +622,16 @@ class Separator(TokenType):
         
         if whitespaceAllowed:
             regexStr = r"\A(.*)(" + tmp + ")(.*)\Z"
+            self._pattern = tmp
         else:
             regexStr = r"\A(\S+)(" + tmp + ")(\S+)\Z"
-        self._regex = re.compile(regexStr)
+            self._pattern = r"(?<=\S)(?:" + tmp + r")(?=\S)"
+        self._regexStr = regexStr
         self._len = len(tokenText)
     
     def createToken(self, text):
         
-        match = self._regex.match(text)
+        match = self._getRegex().match(text)
 
         if match:
             return Token(match.group(2), [self])
@@ -271,7 +640,7 @@ class Separator(TokenType):
             
     def getRemainingLeft(self, text):
 
-        match = self._regex.match(text)
+        match = self._getRegex().match(text)
 
         if match:
             return match.group(1) or ""
@@ -280,7 +649,7 @@ class Separator(TokenType):
 
     def getRemainingRight(self, text):
 
-        match = self._regex.match(text)
+        match = self._getRegex().match(text)
 
         if match:
             return match.group(3) or ""
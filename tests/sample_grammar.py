@@ -0,0 +1,232 @@
+# coding=UTF-8
+
+# This file is part of TBParser.
+#
+# TBParser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TBParser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TBParser.  If not, see <http://www.gnu.org/licenses/>.
+
+# Beispielgrammatiken für die Tests. Transformationen stehen auf
+# Modulebene, damit auch der Codegenerator sie verwenden kann.
+
+from tbparser.grammar import Grammar, Rule, Switch, tokenNode, sequence, \
+     fork, zeroToMany, zeroToOne, oneToMany, defineRule, expand, transform
+from tbparser.token import Keyword, Word, Separator, Literal
+from tbparser.parser import AstNode
+
+SELECT = Keyword('select', False)
+FROM = Keyword('from', False)
+WHERE = Keyword('where', False)
+ID = Word('[a-zA-Z_][a-zA-Z0-9_]*')
+NUM = Word('[0-9]+')
+COMMA = Separator(',')
+EQ = Separator('=')
+SEMI = Separator(';')
+LPAR = Separator(r'\(')
+RPAR = Separator(r'\)')
+PLUS = Separator('+')
+LIT = Literal.get()
+
+A = Keyword('a')
+B = Keyword('b')
+C = Keyword('c')
+D = Keyword('d')
+X = Keyword('x')
+
+# Einfache SQL-artige Anweisungen:
+
+class Expr(Rule):
+
+    def __init__(self, ident=''):
+
+        Rule.__init__(self, 'expr', ident)
+
+    def expand(self, start, end, context):
+
+        start.connect(fork(
+            tokenNode(ID, 'id'),
+            tokenNode(NUM, 'num'),
+            tokenNode(LIT, 'lit'),
+            sequence(tokenNode(LPAR), Expr('inner'), tokenNode(RPAR))
+            )).connect(zeroToMany(sequence(tokenNode(PLUS, 'op'),
+                                           Expr('rhs')))).connect(end)
+
+class Statement(Rule):
+
+    def __init__(self, ident=''):
+
+        Rule.__init__(self, 'stmt', ident)
+
+    def expand(self, start, end, context):
+
+        start\
+        .connect(tokenNode(SELECT))\
+        .connect(Expr('col'))\
+        .connect(zeroToMany(sequence(tokenNode(COMMA), Expr('col'))))\
+        .connect(tokenNode(FROM))\
+        .connect(tokenNode(ID, 'table'))\
+        .connect(zeroToOne(sequence(tokenNode(WHERE), Expr('lhs'),
+                                    tokenNode(EQ), Expr('rhs'))))\
+        .connect(tokenNode(SEMI))\
+        .connect(end)
+
+class Script(Grammar):
+
+    def __init__(self):
+
+        Grammar.__init__(self, [SELECT, FROM, WHERE, ID, NUM, COMMA, EQ,
+                                SEMI, LPAR, RPAR, PLUS, LIT])
+
+    def expand(self, start, end, context):
+
+        start.connect(oneToMany(Statement('stmt'))).connect(end)
+
+SCRIPT_TEXTS = [
+    "select a, b from t;",
+    "SELECT (a + 1) + 'x y', c FROM tab WHERE a = 12;\nselect z from q;",
+    "select a from t where (a+b) = c; // Kommentar\nselect b from t;",
+    "select /* Block */ a from t;",
+    "select a from ;",
+    "select a b from t;",
+    "",
+    ]
+
+# Mehrdeutige Grammatik mit Backtracking, Switch und Transformationen:
+
+class Item(Rule):
+
+    def __init__(self, ident=''):
+
+        Rule.__init__(self, 'item', ident)
+        self.setContextIndependent()
+
+    def expand(self, start, end, context):
+
+        start.connect(fork(
+            sequence(tokenNode(A, 'a1'), zeroToOne(tokenNode(A, 'a2'))),
+            tokenNode(A, 'a3')
+            )).connect(end)
+
+# Entscheidung erst am zweiten Token:
+class Pair(Rule):
+
+    def __init__(self, ident=''):
+
+        Rule.__init__(self, 'pair', ident)
+        self.setContextIndependent()
+
+    def expand(self, start, end, context):
+
+        start.connect(fork(
+            sequence(tokenNode(A, 'x'), tokenNode(B)),
+            sequence(tokenNode(A, 'y'), tokenNode(C)),
+            sequence(tokenNode(A, 'z'), tokenNode(D))
+            )).connect(end)
+
+class Upper(Rule):
+
+    def __init__(self, ident=''):
+
+        Rule.__init__(self, 'upper', ident)
+
+    def expand(self, start, end, context):
+
+        start.connect(oneToMany(fork(Item('it'), tokenNode(ID, 'w'))))\
+        .connect(end)
+
+    def transform(self, astNode):
+
+        astNode.setName('UP')
+
+        return astNode
+
+Assignment = defineRule('assignment')
+
+@expand(Assignment)
+def expandAssignment(start, end, context):
+
+    start\
+    .connect(tokenNode(ID, 'name'))\
+    .connect(tokenNode(D))\
+    .connect(tokenNode(ID, 'value'))\
+    .connect(end)
+
+@transform(Assignment)
+def transformAssignment(astNode):
+
+    name = astNode.getChildById('name').getText()
+    value = astNode.getChildById('value').getText()
+
+    return AstNode('assign', name + '=' + value)
+
+class Ambiguous(Grammar):
+
+    def __init__(self):
+
+        Grammar.__init__(self, [A, B, C, D, X, ID, SEMI])
+
+    def expand(self, start, end, context):
+
+        start.connect(zeroToMany(fork(
+            sequence(zeroToMany(Item('i')),
+                     fork(sequence(tokenNode(A), tokenNode(B, 'b')),
+                          tokenNode(C, 'c'))),
+            Switch({B: sequence(tokenNode(B, 'sw'), tokenNode(ID)),
+                    C: sequence(tokenNode(C, 'swc'), Assignment('as'))}),
+            sequence(tokenNode(X), Pair('p'), zeroToOne(Pair('q'))),
+            sequence(tokenNode(SEMI), Upper('u'), tokenNode(SEMI))
+            ))).connect(end)
+
+AMBIGUOUS_TEXTS = [
+    "a a a b",
+    "a a a a a c",
+    "a " * 14 + "a b",
+    "b z a b",
+    "a a x",
+    "a " * 8 + "z",
+    "x a d",
+    "x a c a b",
+    "x a c a",
+    "x a d a d a b",
+    "x a",
+    "x a b ; x q",
+    "c k d v",
+    "c k d",
+    "; a a q a ; b zz",
+    "; ;",
+    "",
+    "b",
+    "a a",
+    "; a ; c c k d v c",
+    ]
+
+def dumpAst(astNode, indent=0):
+
+    res = '  ' * indent + '%s[%s]=%r\n' % (astNode.getName(),
+                                          astNode.getId(),
+                                          astNode.getText())
+    for child in astNode.getChildren():
+        res += dumpAst(child, indent + 1)
+
+    return res
+
+# AST bzw. Fehlermeldung je Text:
+def parseAll(parser, texts):
+
+    res = []
+    for text in texts:
+        try:
+            res.append(dumpAst(parser.parseString(text)))
+        except Exception, error:
+            res.append('%s: %s' % (type(error).__name__, error))
+
+    return res
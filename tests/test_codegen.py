@@ -0,0 +1,125 @@
+# coding=UTF-8
+
+# This file is part of TBParser.
+#
+# TBParser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TBParser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TBParser.  If not, see <http://www.gnu.org/licenses/>.
+
+import gc
+import imp
+import os
+import shutil
+import tempfile
+import unittest
+
+from tbparser.grammar import Grammar, Rule, tokenNode
+from tbparser.parser import Parser
+from tbparser.codegen import ParserGenerator, CodeGenerationError
+
+from sample_grammar import Script, Ambiguous, SCRIPT_TEXTS, \
+     AMBIGUOUS_TEXTS, A, parseAll
+from test_parser import Environment, INVALID_TEXTS
+
+class ContextReader(Rule):
+
+    def __init__(self, ident=''):
+
+        Rule.__init__(self, 'reader', ident)
+
+    def expand(self, start, end, context):
+
+        if context.getCurKeyword():
+            start.connect(tokenNode(A)).connect(end)
+        else:
+            start.connect(end)
+
+class ContextGrammar(Grammar):
+
+    def __init__(self):
+
+        Grammar.__init__(self, [A])
+
+    def expand(self, start, end, context):
+
+        start.connect(ContextReader()).connect(end)
+
+class GeneratorTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self._moduleDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self._moduleDir)
+
+    def createParsers(self, grammarClass):
+
+        name = 'generated_%s' % grammarClass.__name__.lower()
+        filePath = os.path.join(self._moduleDir, name + '.py')
+        ParserGenerator(grammarClass()).writeModule(filePath)
+        module = imp.load_source(name, filePath)
+
+        parsers = [Parser(grammarClass()), module.Parser(grammarClass())]
+        for parser in parsers:
+            parser.enableLineComments()
+            parser.enableBlockComments()
+
+        return parsers
+
+    def checkSameResults(self, grammarClass, texts):
+
+        runtime, generated = self.createParsers(grammarClass)
+        expected = parseAll(runtime, texts)
+
+        for rep in range(2):
+            self.assertEqual(parseAll(generated, texts), expected)
+
+    def testScript(self):
+
+        self.checkSameResults(Script, SCRIPT_TEXTS)
+
+    def testAmbiguous(self):
+
+        self.checkSameResults(Ambiguous, AMBIGUOUS_TEXTS)
+
+    def testInvalidTexts(self):
+
+        self.checkSameResults(Ambiguous, INVALID_TEXTS)
+
+    def testGarbageCollectionUntouched(self):
+
+        runtime, generated = self.createParsers(Script)
+
+        try:
+            for enabled in (False, True):
+                if enabled:
+                    gc.enable()
+                else:
+                    gc.disable()
+                generated.parseString(SCRIPT_TEXTS[0])
+                self.assertEqual(gc.isenabled(), enabled)
+                self.assertRaises(Exception, generated.parseString,
+                                  SCRIPT_TEXTS[4])
+                self.assertEqual(gc.isenabled(), enabled)
+        finally:
+            gc.enable()
+
+    def testUnsupportedGrammars(self):
+
+        for grammarClass in (Environment, ContextGrammar):
+            generator = ParserGenerator(grammarClass())
+            self.assertRaises(CodeGenerationError, generator.generate)
+
+if __name__ == '__main__':
+    unittest.main()
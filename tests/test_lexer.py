@@ -0,0 +1,628 @@
+# coding=UTF-8
+
+# This file is part of TBParser.
+#
+# TBParser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TBParser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TBParser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tbparser.lexer import Lexer, LexerEngine, TokenTextMode, WSCharCode
+from tbparser.token import Keyword, Word, Prefix, Postfix, Separator, Literal, \
+     BytesToken
+from tbparser.instream import StringInput, MmapFileInput
+from tbparser.lexer_tables import LexerTableCache
+
+TEXTS = [
+    "if a == b; select x, y from t",
+    "SELECT (a+b) from Tab; c=d!",
+    "-x + 'it''s' + \"a \\\" b\" // Kommentar\nnext",
+    "/* Block\n Kommentar */ a/*x*/b\n\n  12 , -3!",
+    "a /* offen",
+    "/*c*//*c*/ a /*c*//*c*///c\nb",
+    "/*c*/*/ a",
+    "a//b",
+    "x /*c*/'y z' // c",
+    "",
+    "   \n\t ",
+]
+
+def createLexer(engine, numSeparators=0):
+
+    lexer = Lexer()
+    for tokenType in [Keyword('if'), Keyword('select', False),
+                      Keyword('from', False),
+                      Word('[a-zA-Z_][a-zA-Z0-9_]*'), Word('[0-9]+'),
+                      Separator('+'), Separator(r'\('), Separator(r'\)'),
+                      Separator(';'), Separator('=='), Separator('='),
+                      Separator(','), Prefix('-'), Postfix('!'),
+                      Literal.get()]:
+        lexer.addTokenType(tokenType)
+    for idx in range(numSeparators):
+        lexer.addTokenType(Separator('#%d#' % idx))
+    lexer.enableLineComments('//')
+    lexer.enableBlockComments('/*', '*/')
+    lexer.setEngine(engine)
+
+    return lexer
+
+class TrickleInput(StringInput):
+    
+    # Liefert je Lesezugriff nur wenige Zeichen und keinen vollständigen
+    # Text, damit der Lexer ständig nachladen muss:
+    
+    def __init__(self, text, size):
+        
+        StringInput.__init__(self, text)
+        
+        self._size = size
+    
+    def read(self, size):
+        
+        return StringInput.read(self, min(size, self._size))
+    
+    def getSource(self):
+        
+        return None
+
+class CountingInput(StringInput):
+
+    # Zählt die gelesenen Zeichen (ohne vollständigen Text, damit der Lexer
+    # aus dem Strom liest):
+
+    def __init__(self, text):
+
+        StringInput.__init__(self, text)
+
+        self.numRead = 0
+
+    def read(self, size):
+
+        res = StringInput.read(self, size)
+        self.numRead += len(res)
+
+        return res
+
+    def getSource(self):
+
+        return None
+
+def describe(tokens):
+
+    return [(token.getText(), token.getTypeMask(), token.getStartPosition())
+            for token in tokens]
+
+def tokenize(lexer, text):
+
+    try:
+        return describe(lexer.tokenizeString(text))
+    except Exception, error:
+        return str(error)
+
+class EngineTest(unittest.TestCase):
+
+    def testEnginesAgree(self):
+
+        classic = createLexer(LexerEngine.CLASSIC)
+        regex = createLexer(LexerEngine.REGEX)
+
+        for text in TEXTS:
+            self.assertEqual(tokenize(classic, text), tokenize(regex, text))
+
+    def testEnginesAgreeOnStreams(self):
+        
+        classic = createLexer(LexerEngine.CLASSIC)
+        regex = createLexer(LexerEngine.REGEX)
+        
+        for text in TEXTS:
+            expected = tokenize(classic, text)
+            for size in (1, 2, 3, 7):
+                try:
+                    result = describe(regex.tokenize(TrickleInput(text, size)))
+                except Exception, error:
+                    result = str(error)
+                self.assertEqual(result, expected)
+
+    def testUnknownToken(self):
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = createLexer(engine)
+            self.assertRaises(Exception, list, lexer.tokenizeString("a ? b"))
+
+    def testManySeparators(self):
+
+        # Mehr Gruppen, als das re-Modul in einem Ausdruck erlaubt:
+        text = "a#5#b #119# c#99##1#d -e! 'x #3# y'"
+        expected = ['a', '#5#', 'b', '#119#', 'c', '#99#', '#1#', 'd',
+                    '-', 'e', '!', "'x #3# y'"]
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = createLexer(engine, 120)
+            texts = [token.getText() for token in lexer.tokenizeString(text)]
+            self.assertEqual(texts, expected)
+
+    def testManyAffixes(self):
+
+        lexer = Lexer()
+        lexer.addTokenType(Word('[a-z]+'))
+        for idx in range(120):
+            lexer.addTokenType(Prefix('@%d@' % idx))
+            lexer.addTokenType(Postfix('!%d!' % idx))
+
+        texts = [token.getText()
+                 for token in lexer.tokenizeString("@3@x y!4! @101@z!110!")]
+        self.assertEqual(texts, ['@3@', 'x', 'y', '!4!',
+                                 '@101@', 'z', '!110!'])
+
+    def testSplitting(self):
+
+        # Zerlegung wie in den bisherigen Versionen: zuerst am längsten
+        # Trenner, Literale mit demselben Begrenzer direkt hintereinander
+        # als ein Literal:
+        cases = [("a===b", ['a', '=', '==', 'b']),
+                 ("a==b=c", ['a', '==', 'b', '=', 'c']),
+                 ("'it''s'", ["'it''s'"]),
+                 ("-'x'", ['-', "'x'"]),
+                 ("'x'!", ["'x'", '!']),
+                 ("f('a,b')", ['f', '(', "'a,b'", ')']),
+                 ("'a'==-b", ["'a'", '==', '-', 'b'])]
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = createLexer(engine)
+            for text, expected in cases:
+                texts = [token.getText()
+                         for token in lexer.tokenizeString(text)]
+                self.assertEqual(texts, expected)
+
+class GeneratorTest(unittest.TestCase):
+
+    def testLazyTokens(self):
+
+        text = "a b c " * 20000 + "?"
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = createLexer(engine)
+            instream = CountingInput(text)
+            tokens = lexer.tokenize(instream)
+
+            self.assertEqual(next(tokens).getText(), 'a')
+            self.assertTrue(instream.numRead < len(text))
+            # getNextToken setzt denselben Generator fort:
+            self.assertEqual(lexer.getNextToken().getText(), 'b')
+            self.assertEqual(next(tokens).getText(), 'c')
+            # Der Fehler am Ende fällt erst beim Weiterlesen auf:
+            self.assertRaises(Exception, list, tokens)
+
+    def testGeneratorMatchesGetNextToken(self):
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = createLexer(engine)
+            for text in TEXTS:
+                expected = tokenize(lexer, text)
+                if not isinstance(expected, list):
+                    continue
+                lexer.setInputStream(StringInput(text))
+                tokens = []
+                token = lexer.getNextToken()
+                while token:
+                    tokens.append(token)
+                    token = lexer.getNextToken()
+                self.assertEqual(describe(tokens), expected)
+
+class KeywordTest(unittest.TestCase):
+
+    def testExactCaseFirst(self):
+
+        exact = Keyword('Select')
+        folded = Keyword('select', False)
+        other = Keyword('if')
+        ident = Word('[a-zA-Z]+')
+
+        text = "Select SELECT select if IF sElect"
+        expected = [set([exact, ident]), set([folded, ident]), 
+                    set([folded, ident]), set([other, ident]), set([ident]),
+                    set([folded, ident])]
+
+        # Auch wenn der Index erst beim Schlüsselwort ohne Beachtung der
+        # Groß-/Kleinschreibung umgestellt wird:
+        for tokenTypes in ([exact, folded, other, ident], 
+                           [other, exact, folded, ident],
+                           [folded, exact, ident, other]):
+            for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+                lexer = Lexer()
+                for tokenType in tokenTypes:
+                    lexer.addTokenType(tokenType)
+                lexer.setEngine(engine)
+                types = [set(token.getTypes()) 
+                         for token in lexer.tokenizeString(text)]
+                self.assertEqual(types, expected)
+
+    def testKeywordsOnly(self):
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = Lexer()
+            lexer.addTokenType(Keyword('if'))
+            lexer.addTokenType(Keyword('then', False))
+            lexer.setEngine(engine)
+            texts = [token.getText() 
+                     for token in lexer.tokenizeString("if THEN Then")]
+            self.assertEqual(texts, ['if', 'THEN', 'Then'])
+            self.assertRaises(Exception, list, lexer.tokenizeString("IF"))
+
+class WhiteSpaceTest(unittest.TestCase):
+
+    def createLexer(self, engine):
+
+        lexer = Lexer()
+        lexer.addTokenType(Word(r'[^\s,]+'))
+        lexer.addTokenType(Separator(','))
+        lexer.setWhiteSpace(WSCharCode.DEFAULT + WSCharCode.UNICODE)
+        lexer.setEngine(engine)
+
+        return lexer
+
+    def testUnicodeWhiteSpace(self):
+
+        text = u"voil\xe0\xa0\xc5ngstr\xf6m\u2003x,\u3000y \x85z"
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            texts = [token.getText()
+                     for token in self.createLexer(engine).tokenizeString(text)]
+            self.assertEqual(texts, [u"voil\xe0", u"\xc5ngstr\xf6m", u"x", 
+                                     u",", u"y", u"z"])
+
+    def testCustomSet(self):
+
+        text = "a__b \r\nc,_d" + " " * 20 + "e"
+        expected = [('a', (1, 1)), ('b', (1, 4)), ('c', (2, 1)), 
+                    (',', (2, 2)), ('d', (2, 4)), ('e', (2, 25))]
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = Lexer()
+            lexer.addTokenType(Word('[a-z]+'))
+            lexer.addTokenType(Separator(','))
+            lexer.setWhiteSpace([WSCharCode.SPACE, WSCharCode.LINEBREAK, 
+                                 WSCharCode.CARRIAGE_RETURN, ord('_')])
+            lexer.setEngine(engine)
+            # Auch mit Nachladen mitten in Whitespace-Folgen:
+            for instream in (StringInput(text), TrickleInput(text, 3)):
+                tokens = [(token.getText(), token.getStartPosition())
+                          for token in lexer.tokenize(instream)]
+                self.assertEqual(tokens, expected)
+            # Tabulator gehört hier nicht dazu:
+            self.assertRaises(Exception, list, lexer.tokenizeString("a\tb"))
+
+    def testUtf8Bytes(self):
+
+        # Bytes ab 0x80 sind in UTF-8 Teil von Mehrbyte-Zeichen (à endet
+        # mit 0xa0, Å beginnt mit 0xc3 0x85), hier gilt nur ASCII-Whitespace:
+        text = "voil\xc3\xa0 \xc3\x85ngstr\xc3\xb6m\tx,y"
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = self.createLexer(engine)
+            # Auch im Wechsel mit Unicode-Eingaben:
+            for rep in range(2):
+                texts = [token.getText() 
+                         for token in lexer.tokenizeString(text)]
+                self.assertEqual(texts, ["voil\xc3\xa0", 
+                                         "\xc3\x85ngstr\xc3\xb6m", 
+                                         "x", ",", "y"])
+                list(lexer.tokenizeString(u"a\xa0b"))
+
+class BytesModeTest(unittest.TestCase):
+
+    def testSameTokens(self):
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = createLexer(engine)
+            bytesLexer = createLexer(engine)
+            bytesLexer.setBytesMode()
+            for text in TEXTS:
+                expected = tokenize(lexer, text)
+                self.assertEqual(tokenize(bytesLexer, text), expected)
+                if not isinstance(expected, list):
+                    continue
+                for token in bytesLexer.tokenizeString(text):
+                    self.assertTrue(isinstance(token, BytesToken))
+                    self.assertTrue(isinstance(token.getBytes(), str))
+                    self.assertTrue(isinstance(token.getText(), unicode))
+
+    def testDecoding(self):
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = Lexer()
+            lexer.addTokenType(Word(r'[^\s,]+'))
+            lexer.addTokenType(Separator(','))
+            lexer.setEngine(engine)
+            lexer.setBytesMode('utf-8')
+
+            tokens = list(lexer.tokenizeString("voil\xc3\xa0,x"))
+            self.assertEqual([token.getBytes() for token in tokens],
+                             ["voil\xc3\xa0", ",", "x"])
+            self.assertEqual([token.getText() for token in tokens],
+                             [u"voil\xe0", u",", u"x"])
+            # Kopien (s. relex) dekodieren ebenso:
+            self.assertEqual(tokens[0].copy().getText(), u"voil\xe0")
+
+            # Ohne Bytes-Modus wieder gewöhnliche Tokens:
+            lexer.setBytesMode(None)
+            token = next(lexer.tokenizeString("x"))
+            self.assertFalse(isinstance(token, BytesToken))
+            self.assertEqual(token.getText(), "x")
+
+class TableTest(unittest.TestCase):
+
+    def testTableMatchesTokens(self):
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = createLexer(engine)
+            for text in TEXTS:
+                expected = tokenize(lexer, text)
+                # Mit vollständigem Quelltext und mit Eingabestrom:
+                for instream in (StringInput(text), TrickleInput(text, 3)):
+                    if not isinstance(expected, list):
+                        self.assertRaises(Exception, lexer.tokenizeTable, 
+                                          instream)
+                        continue
+                    table = lexer.tokenizeTable(instream)
+                    self.assertEqual(len(table), len(expected))
+                    self.assertEqual(describe(table), expected)
+                    self.assertEqual(describe(table.iterRefs()), expected)
+
+class FileTest(unittest.TestCase):
+
+    TEXT = "\n".join(TEXTS[:3] + [TEXTS[8]])
+
+    def setUp(self):
+
+        handle, self._filePath = tempfile.mkstemp()
+        os.write(handle, FileTest.TEXT)
+        os.close(handle)
+
+    def tearDown(self):
+
+        os.remove(self._filePath)
+
+    def testSourceModeWithMmap(self):
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            expected = tokenize(createLexer(engine), FileTest.TEXT)
+
+            lexer = createLexer(engine)
+            lexer.setTokenTextMode(TokenTextMode.SOURCE)
+            instream = MmapFileInput(self._filePath)
+            try:
+                self.assertEqual(describe(lexer.tokenize(instream)), expected)
+            finally:
+                instream.close()
+
+    def testMmapInput(self):
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            expected = tokenize(createLexer(engine), FileTest.TEXT)
+
+            # Bytes direkt aus dem Mapping und inkrementell dekodiert (mit
+            # kleinen Blöcken, damit mehrfach nachgeladen wird):
+            for encoding in (None, 'utf-8'):
+                for blockSize in (5, MmapFileInput.BLOCK_SIZE):
+                    instream = MmapFileInput(self._filePath, encoding, 
+                                             blockSize)
+                    try:
+                        self.assertEqual(describe(createLexer(engine).tokenize(
+                            instream)), expected)
+                    finally:
+                        instream.close()
+
+    def testMultiByteCharacters(self):
+
+        text = u"voil\xe0, \xe5ngstr\xf6m \u20ac"
+        with open(self._filePath, 'wb') as outFile:
+            outFile.write(text.encode('utf-8'))
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = Lexer()
+            lexer.addTokenType(Word(r'[^\s,]+'))
+            lexer.addTokenType(Separator(','))
+            lexer.setEngine(engine)
+            # Blockgrenzen mitten in Zeichen:
+            for blockSize in (1, 2, 3):
+                instream = MmapFileInput(self._filePath, 'utf-8', blockSize)
+                try:
+                    texts = [token.getText() 
+                             for token in lexer.tokenize(instream)]
+                finally:
+                    instream.close()
+                self.assertEqual(texts, [u"voil\xe0", u",", 
+                                         u"\xe5ngstr\xf6m", u"\u20ac"])
+
+    def testEmptyFile(self):
+
+        open(self._filePath, 'w').close()
+
+        for encoding in (None, 'utf-8'):
+            instream = MmapFileInput(self._filePath, encoding)
+            try:
+                self.assertEqual(
+                    list(createLexer(LexerEngine.REGEX).tokenize(instream)), [])
+            finally:
+                instream.close()
+
+class RelexTest(unittest.TestCase):
+    
+    SOURCE = ("select a, b+c, 'lit eral' from t; // Kommentar\n"
+              "/* Block */ if x == 12; -y!\n") * 3
+    
+    # (offset, removedLength, insertedText):
+    EDITS = [(0, 0, "x "), (0, 6, "SELECT"), (7, 1, "abc"), (8, 2, ""),
+             (10, 0, "'q' "), (15, 10, "'x'"), (31, 0, "/* neu */ "),
+             (46, 1, " "), (59, 0, "/*"), (67, 2, "3 + 'z'"), 
+             (76, 0, "\n\n"), (150, 4, "//"), (225, 0, " end"), 
+             (10, 0, "'")]
+    
+    def dump(self, tokens):
+        
+        return [(token.getText(), token.getTypeMask(), 
+                 token.getStartOffset(), token.getStartPosition()) 
+                for token in tokens]
+        
+    def testRelexMatchesFullLex(self):
+        
+        source = RelexTest.SOURCE
+        
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            for mode in (TokenTextMode.COPY, TokenTextMode.SOURCE):
+                for offset, removedLength, insertedText in RelexTest.EDITS:
+                    text = source[:offset] + insertedText + \
+                        source[offset + removedLength:]
+                    
+                    lexer = createLexer(engine)
+                    lexer.setTokenTextMode(mode)
+                    tokens = list(lexer.tokenizeString(source))
+                    original = self.dump(tokens)
+                    
+                    try:
+                        expected = self.dump(lexer.tokenizeString(text))
+                    except Exception:
+                        self.assertRaises(Exception, lexer.relex, source, 
+                                          tokens, offset, removedLength, 
+                                          insertedText)
+                        continue
+                    
+                    result = lexer.relex(source, tokens, offset, 
+                                         removedLength, insertedText)
+                    self.assertEqual(self.dump(result), expected)
+                    # Die alten Tokens bleiben unverändert:
+                    self.assertEqual(self.dump(tokens), original)
+
+class ParallelTest(unittest.TestCase):
+
+    SOURCE = ("select a, b+c, 'lit eral' from t; // Kommentar\n"
+              "/* Block */ if x == 12; -y!\n") * 20
+
+    def check(self, text, numProcesses, chunkSize=100):
+
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            lexer = createLexer(engine)
+            expected = tokenize(lexer, text)
+            try:
+                result = describe(lexer.tokenizeParallel(StringInput(text),
+                                                         numProcesses,
+                                                         chunkSize))
+            except Exception, error:
+                result = str(error)
+            self.assertEqual(result, expected)
+
+    def testChunksMatchSerial(self):
+
+        self.check(ParallelTest.SOURCE, 2)
+        # Abschnitte größer als die Eingabe:
+        self.check(ParallelTest.SOURCE, 2, 1 << 20)
+
+    def testSerialFallback(self):
+
+        source = ParallelTest.SOURCE
+        # Blockkommentar über Abschnittsgrenzen hinweg:
+        self.check(source[:500] + "/* a\n" * 60 + "b */ x\n" + source, 2)
+        # Fehler in einem Abschnitt:
+        self.check(source + "a ? b\n" + source, 2)
+        # Nur ein Prozess:
+        self.check(source, 1)
+
+class TableCacheTest(unittest.TestCase):
+    
+    def setUp(self):
+        
+        self._cacheDir = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        
+        shutil.rmtree(self._cacheDir)
+    
+    def createLexer(self, engine):
+        
+        # Mit mehr als 100 Separatoren und einem Wort mit Inline-Flag, damit
+        # auch aufgeteilte und getrennte Ausdrücke gespeichert werden:
+        lexer = createLexer(engine, 120)
+        lexer.addTokenType(Word('(?i)sel'))
+        
+        return lexer
+
+    def testRoundTrip(self):
+        
+        text = TEXTS[0] + " a#5#b #119# SEL\n" + TEXTS[3]
+        
+        for engine in (LexerEngine.CLASSIC, LexerEngine.REGEX):
+            expected = tokenize(self.createLexer(engine), text)
+            
+            lexer = self.createLexer(engine)
+            self.assertFalse(lexer.useTableCache(self._cacheDir))
+            self.assertEqual(tokenize(lexer, text), expected)
+            
+            lexer = self.createLexer(engine)
+            self.assertTrue(lexer.useTableCache(self._cacheDir))
+            self.assertEqual(tokenize(lexer, text), expected)
+            
+    def testInvalidEntry(self):
+        
+        cache = LexerTableCache(self._cacheDir)
+        
+        for tables in ({'master': 42}, {'master': (42, 0)}, {}):
+            lexer = self.createLexer(LexerEngine.REGEX)
+            cache.save(lexer.getTablesKey(), tables)
+            self.assertFalse(lexer.useTableCache(self._cacheDir))
+            self.assertEqual(tokenize(lexer, TEXTS[0]),
+                             tokenize(createLexer(LexerEngine.REGEX), 
+                                      TEXTS[0]))
+        
+    def testUnusableDirectory(self):
+        
+        # Verzeichnis unterhalb einer Datei kann nicht angelegt werden:
+        path = os.path.join(self._cacheDir, 'file')
+        open(path, 'w').close()
+        
+        lexer = self.createLexer(LexerEngine.REGEX)
+        self.assertFalse(lexer.useTableCache(os.path.join(path, 'cache')))
+        self.assertEqual(tokenize(lexer, TEXTS[0]),
+                         tokenize(createLexer(LexerEngine.REGEX), TEXTS[0]))
+
+class WordTest(unittest.TestCase):
+
+    def testInlineFlagsStayLocal(self):
+
+        upper = Word('[A-Z]+')
+        select = Word('(?i)sel')
+        lexer = Lexer()
+        lexer.addTokenType(upper)
+        lexer.addTokenType(select)
+
+        tokens = list(lexer.tokenizeString("ABC sel SEL"))
+        self.assertEqual([token.getTypes() for token in tokens],
+                         [[upper], [select], [upper, select]])
+        self.assertRaises(Exception, list, lexer.tokenizeString("abc"))
+
+    def testNamedBackReference(self):
+
+        double = Word('(?P<c>[a-z])(?P=c)')
+        lexer = Lexer()
+        lexer.addTokenType(Word('[0-9]+'))
+        lexer.addTokenType(double)
+
+        tokens = list(lexer.tokenizeString("aa 12"))
+        self.assertEqual(tokens[0].getTypes(), [double])
+        self.assertRaises(Exception, list, lexer.tokenizeString("ab"))
+
+if __name__ == '__main__':
+    unittest.main()
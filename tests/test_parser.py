@@ -0,0 +1,258 @@
+# coding=UTF-8
+
+# This file is part of TBParser.
+#
+# TBParser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TBParser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TBParser.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+
+from tbparser.grammar import Grammar, Rule, Condition, tokenNode, sequence, \
+     fork, zeroToMany, ANY_TOKEN_TYPE
+from tbparser.parser import Parser
+from tbparser.instream import StringInput
+
+from sample_grammar import Script, Ambiguous, Statement, Expr, SCRIPT_TEXTS, \
+     AMBIGUOUS_TEXTS, A, B, X, ID, NUM, LIT, LPAR, SELECT, SEMI, dumpAst, \
+     parseAll
+
+# Regel mit Umgebungsvariable, die in einer Condition gelesen wird:
+class Flagged(Rule):
+
+    def __init__(self, flag, ident=''):
+
+        Rule.__init__(self, 'flagged', ident)
+        if flag:
+            self.setEnvVar('flag', True)
+
+    def expand(self, start, end, context):
+
+        start.connect(fork(
+            sequence(Condition(lambda context: context['flag']),
+                     tokenNode(X, 'set')),
+            tokenNode(X, 'unset')
+            )).connect(end)
+
+class Environment(Grammar):
+
+    def __init__(self):
+
+        Grammar.__init__(self, [A, X, ID, SEMI])
+
+    def expand(self, start, end, context):
+
+        start.connect(zeroToMany(fork(
+            sequence(tokenNode(SEMI), fork(Flagged(True, 'f1'),
+                                           Flagged(False, 'f2')),
+                     tokenNode(ID)),
+            sequence(tokenNode(A), Flagged(False, 'f3'))
+            ))).connect(end)
+
+ENVIRONMENT_TEXTS = ["; x q ; x r", "a x ; x a", "a a", "; q", ""]
+
+# Fehlerhafte Texte, deren Meldung davon abhängt, wo die Suche zuletzt
+# gescheitert ist (am Ende der Eingabe oder an einem Token):
+INVALID_TEXTS = ["; a c c", "; k a k x a a", "; a a a a a a d", "a a a a z",
+                 "x a c a d z", "; a ; c c"]
+
+class CompileTest(unittest.TestCase):
+
+    def createParser(self, grammarClass, compiled=False, memo=False):
+
+        parser = Parser(grammarClass())
+        parser.enableLineComments()
+        parser.enableBlockComments()
+        if memo:
+            parser.enableMemo()
+        if compiled:
+            parser.compile()
+
+        return parser
+
+    def checkVariants(self, grammarClass, texts):
+
+        expected = parseAll(self.createParser(grammarClass), texts)
+
+        for compiled, memo in [(True, False), (False, True), (True, True)]:
+            parser = self.createParser(grammarClass, compiled, memo)
+            # Zweimal, damit auch wiederverwendete Tabellen und Expansionen
+            # geprüft werden:
+            for rep in range(2):
+                self.assertEqual(parseAll(parser, texts), expected)
+
+    def testScript(self):
+
+        self.checkVariants(Script, SCRIPT_TEXTS)
+
+    def testAmbiguous(self):
+
+        self.checkVariants(Ambiguous, AMBIGUOUS_TEXTS)
+
+    def testInvalidTexts(self):
+
+        self.checkVariants(Ambiguous, INVALID_TEXTS)
+        results = parseAll(self.createParser(Ambiguous, memo=True),
+                           INVALID_TEXTS)
+        self.assertEqual(results[0], 'Exception: Parsing error')
+        self.assertTrue(results[3].startswith('ParseError'))
+
+    def testEnvironment(self):
+
+        self.checkVariants(Environment, ENVIRONMENT_TEXTS)
+
+    def testTablesFilledByCompile(self):
+
+        grammar = Ambiguous()
+        grammar.setContextIndependent()
+        parser = Parser(grammar)
+        parser.compile()
+
+        typeTable = grammar.getTokenTypeTable()
+        table = grammar.getSocket().getPredictionTable()
+        for tokenType in grammar.getTokenTypes():
+            self.assertTrue(typeTable.getMask(tokenType) in table)
+        # LL(2): Auch die Einträge für das nächste Token sind gefüllt
+        entry = table[typeTable.getMask(A)]
+        self.assertTrue(isinstance(entry, dict))
+        self.assertTrue(typeTable.getMask(B) in entry)
+        self.assertTrue(None in entry)
+
+        # LL(1)-Einträge der übrigen stabilen Knoten (z.B. in Item):
+        segments = []
+        stack = [grammar.getSocket()]
+        visited = set()
+        while stack:
+            node = stack.pop()
+            if node not in visited and node.isStable():
+                visited.add(node)
+                segments.extend([entry for entry in
+                                 node.getPredictionTable().values()
+                                 if isinstance(entry, tuple) and entry])
+                stack.extend(node.getLinkedNodes())
+        self.assertTrue(segments)
+
+        expected = parseAll(self.createParser(Ambiguous), AMBIGUOUS_TEXTS)
+        parser.enableLineComments()
+        parser.enableBlockComments()
+        self.assertEqual(parseAll(parser, AMBIGUOUS_TEXTS), expected)
+
+    def testErrorsReported(self):
+
+        for compiled in (False, True):
+            results = parseAll(self.createParser(Script, compiled),
+                               SCRIPT_TEXTS)
+            self.assertTrue(results[0].startswith('Script'))
+            self.assertTrue(results[4].startswith('ParseError'))
+
+# Regel, deren Expansion den Kontext liest:
+class KeywordReader(Rule):
+
+    def __init__(self, ident=''):
+
+        Rule.__init__(self, 'reader', ident)
+
+    def expand(self, start, end, context):
+
+        if context.getCurKeyword():
+            start.connect(tokenNode(A)).connect(end)
+        else:
+            start.connect(end)
+
+class FirstSetTest(unittest.TestCase):
+
+    def testKnownBeforeExpansion(self):
+
+        typeTable = Script().getTokenTypeTable()
+
+        mask = Statement().getSocket().getFirstMask(typeTable)
+        self.assertEqual(mask, typeTable.getMask(SELECT))
+
+        mask = Expr().getSocket().getFirstMask(typeTable)
+        expected = 0
+        for tokenType in (ID, NUM, LIT, LPAR):
+            expected |= typeTable.getMask(tokenType)
+        self.assertEqual(mask, expected)
+
+    def testContextDependentRule(self):
+
+        typeTable = Ambiguous().getTokenTypeTable()
+        mask = KeywordReader().getSocket().getFirstMask(typeTable)
+        self.assertEqual(mask, ANY_TOKEN_TYPE)
+
+class TableTest(unittest.TestCase):
+
+    def checkTables(self, grammarClass, texts):
+
+        parser = Parser(grammarClass())
+        parser.enableLineComments()
+        parser.enableBlockComments()
+        expected = parseAll(parser, texts)
+
+        results = []
+        for text in texts:
+            try:
+                table = parser.tokenizeTable(StringInput(text))
+                results.append(dumpAst(parser.parseTable(table)))
+            except Exception, error:
+                results.append('%s: %s' % (type(error).__name__, error))
+        self.assertEqual(results, expected)
+
+    def testScript(self):
+
+        self.checkTables(Script, SCRIPT_TEXTS)
+
+    def testAmbiguous(self):
+
+        self.checkTables(Ambiguous, AMBIGUOUS_TEXTS)
+
+class FileTest(unittest.TestCase):
+
+    def setUp(self):
+
+        handle, self._filePath = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+
+        os.remove(self._filePath)
+
+    def parseFile(self, parser, encoding, mmap):
+
+        try:
+            return dumpAst(parser.parseFile(self._filePath, encoding, mmap))
+        except Exception, error:
+            return '%s: %s' % (type(error).__name__, error)
+
+    def testParseFileWithMmap(self):
+
+        parser = Parser(Script())
+        parser.enableLineComments()
+        parser.enableBlockComments()
+        expected = parseAll(parser, SCRIPT_TEXTS)
+
+        for text, result in zip(SCRIPT_TEXTS, expected):
+            with open(self._filePath, 'w') as outFile:
+                outFile.write(text)
+            for encoding in (None, 'utf-8'):
+                reference = self.parseFile(parser, encoding, False)
+                # Fehlermeldungen nennen hier die Datei, dekodierte Texte
+                # sind unicode:
+                if encoding is None and not result.startswith('ParseError'):
+                    self.assertEqual(reference, result)
+                self.assertEqual(self.parseFile(parser, encoding, True),
+                                 reference)
+
+if __name__ == '__main__':
+    unittest.main()